@@ -0,0 +1,172 @@
+import os
+import sys
+
+from bisect import bisect_left
+
+import numpy as np
+
+from forgot_again.file import load_ast_if_exists
+
+KEYS = ('p_lo', 'p_rf', 'f_lo', 'f_rf')
+
+DTYPE = np.dtype([(k, 'f8') for k in (*KEYS, 'k_loss')])
+
+# keys are compared after rounding, GHz and dBm values from the .ini files carry float noise
+_DIGITS = 6
+
+
+def _keys(values):
+    return map(tuple, np.round(np.asarray(values, dtype=float).reshape(-1, len(KEYS)), _DIGITS).tolist())
+
+
+class AdjustmentIndex:
+    """
+    k_loss corrections keyed by (p_lo, p_rf, f_lo, f_rf).
+
+    Exact keys are matched for all points at once: every key column is coded by its rank among the table values
+    and the codes are folded column by column into one rank per point. With `nearest` a miss walks the keys
+    level by level, taking the closest p_lo, then p_rf, f_lo and f_rf present under it, each within `tolerance`
+    (dBm, dBm, GHz, GHz), so a grid template applies to any subset or reordering of its points.
+    """
+
+    def __init__(self, table=None, nearest=False, tolerance=None):
+        self.nearest = nearest
+        self.tolerance = tolerance or (np.inf,) * len(KEYS)
+
+        if isinstance(table, np.ndarray):
+            self._points = table.astype(DTYPE)
+        else:
+            self._points = np.array([tuple(p[k] for k in (*KEYS, 'k_loss')) for p in table or []], dtype=DTYPE)
+        self._exact = dict(zip(
+            _keys([row[:len(KEYS)] for row in self._points.tolist()]),
+            self._points['k_loss'].tolist(),
+        ))
+        self._codes = None
+        self._tree = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def __bool__(self):
+        return len(self._points) > 0
+
+    @classmethod
+    def load(cls, path, nearest=False, tolerance=None):
+        """Reads an adjust_*.ini table or its .npy form, a newer .npy next to the .ini is preferred."""
+        if not path:
+            return cls(nearest=nearest, tolerance=tolerance)
+
+        binary = path if path.endswith('.npy') else os.path.splitext(path)[0] + '.npy'
+        if os.path.isfile(binary) and \
+                (binary == path or not os.path.isfile(path) or os.path.getmtime(binary) >= os.path.getmtime(path)):
+            return cls(np.load(binary, allow_pickle=False), nearest=nearest, tolerance=tolerance)
+
+        return cls(load_ast_if_exists(path, default=None), nearest=nearest, tolerance=tolerance)
+
+    def save(self, path):
+        np.save(path, self._points, allow_pickle=False)
+
+    def table(self):
+        return [
+            {'p_lo': p_lo, 'f_lo': f_lo, 'p_rf': p_rf, 'f_rf': f_rf, 'k_loss': k_loss}
+            for p_lo, p_rf, f_lo, f_rf, k_loss in self._points.tolist()
+        ]
+
+    def lookup(self, p_lo, p_rf, f_lo, f_rf):
+        return float(self.lookup_many([[p_lo, p_rf, f_lo, f_rf]])[0])
+
+    def lookup_many(self, keys):
+        """keys: (n, 4) array of p_lo, p_rf, f_lo, f_rf, returns the n corrections, 0 where nothing matches."""
+        keys = np.round(np.asarray(keys, dtype=float).reshape(-1, len(KEYS)), _DIGITS)
+        result = np.zeros(len(keys))
+        if not self._exact:
+            return result
+        if self._codes is None:
+            self._codes = self._build_codes()
+
+        levels, folds, k_losses = self._codes
+        hit = np.ones(len(keys), dtype=bool)
+        codes = None
+        for column, (values, fold) in enumerate(zip(levels, folds)):
+            code = _find(values, keys[:, column], hit)
+            if fold is not None:
+                code = _find(fold, codes * len(values) + code, hit)
+            codes = code
+        result[hit] = k_losses[codes[hit]]
+
+        if self.nearest:
+            for i in np.flatnonzero(~hit):
+                k_loss = self._lookup_nearest(tuple(keys[i].tolist()))
+                if k_loss is not None:
+                    result[i] = k_loss
+        return result
+
+    def _build_codes(self):
+        # per column: sorted distinct values, and from the second column on the sorted distinct
+        # (code so far, column code) pairs, whose rank is the new code; the last code ranks the table keys
+        keys = np.array(list(self._exact), dtype=float).reshape(-1, len(KEYS))
+        levels, folds = [], []
+        codes = None
+        for column in range(len(KEYS)):
+            values = np.unique(keys[:, column])
+            code = np.searchsorted(values, keys[:, column])
+            fold = None
+            if codes is not None:
+                pairs = codes * len(values) + code
+                fold = np.unique(pairs)
+                code = np.searchsorted(fold, pairs)
+            levels.append(values)
+            folds.append(fold)
+            codes = code
+
+        k_losses = np.empty(len(keys))
+        k_losses[codes] = list(self._exact.values())
+        return levels, folds, k_losses
+
+    def _lookup_nearest(self, key):
+        if self._tree is None:
+            self._tree = self._build_tree()
+
+        node = self._tree
+        for value, tolerance in zip(key, self.tolerance):
+            levels, children = node
+            pos = bisect_left(levels, value)
+            if pos == len(levels) or pos > 0 and value - levels[pos - 1] < levels[pos] - value:
+                pos -= 1
+            if abs(levels[pos] - value) > tolerance:
+                return None
+            node = children[pos]
+        return node
+
+    def _build_tree(self):
+        # nested (sorted level values, children) per key, the leaves are k_loss values
+        def build(items, depth):
+            if depth == len(KEYS):
+                return items[0][1]
+            groups = dict()
+            for key, k_loss in items:
+                groups.setdefault(key[depth], []).append((key, k_loss))
+            levels = sorted(groups)
+            return levels, [build(groups[level], depth + 1) for level in levels]
+
+        return build(list(self._exact.items()), 0)
+
+
+def _find(sorted_values, values, hit):
+    # positions of `values` in `sorted_values`, clears `hit` where a value is not there
+    pos = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    hit &= sorted_values[pos] == values
+    return pos
+
+
+def main(args):
+    # converts adjust_*.ini tables into the binary form: python adjustment.py adjust_+25.ini ...
+    for path in args[1:]:
+        binary = os.path.splitext(path)[0] + '.npy'
+        index = AdjustmentIndex(load_ast_if_exists(path, default=None))
+        index.save(binary)
+        print(f'{path}: {len(index)} points -> {binary}')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,75 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+ROOT = 'demod'
+
+FORMAT = '%(asctime)s %(levelname)-7s %(threadName)s %(name)s: %(message)s'
+
+DEFAULTS = {
+    'log_level': 'INFO',
+    'log_console': True,
+    'log_file': 'log/demod.log',
+    'log_max_bytes': 5_000_000,
+    'log_backups': 5,
+}
+
+_listener = None
+
+
+def get_logger(name):
+    return logging.getLogger(f'{ROOT}.{name}')
+
+
+def setup(params=None):
+    """
+    Routes every `demod.*` logger through a queue, the caller only formats and enqueues a record,
+    the console and the rotating file are written by the listener thread.
+    Calling it again replaces the previous configuration.
+    """
+    global _listener
+
+    params = {**DEFAULTS, **(params or {})}
+    shutdown()
+
+    formatter = logging.Formatter(FORMAT)
+
+    handlers = []
+
+    if params['log_file']:
+        os.makedirs(os.path.dirname(params['log_file']) or '.', exist_ok=True)
+        handlers.append(RotatingFileHandler(params['log_file'], maxBytes=params['log_max_bytes'],
+                                            backupCount=params['log_backups'], encoding='utf-8', delay=True))
+    if params['log_console']:
+        handlers.append(logging.StreamHandler(sys.stdout))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger(ROOT)
+    root.handlers.clear()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(params['log_level'])
+    root.propagate = False
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown():
+    global _listener
+    if _listener is None:
+        return
+    # stop() drains the queue before joining the writer thread
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,185 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import applog
+import settle
+import instrumentcontroller
+
+from instrumentcontroller import InstrumentController
+
+# (LO count, IF count, voltage steps)
+GRIDS = [
+    (2, 4, 3),
+    (5, 18, 11),
+    (9, 18, 21),
+]
+
+QUICK_GRIDS = [
+    (2, 3, 2),
+]
+
+VARIANTS = {
+    'serial': {'scpi_cache': False, 'pipeline': False},
+    'cached': {'scpi_cache': True, 'pipeline': False},
+    'pipeline': {'scpi_cache': True, 'pipeline': True},
+    'list': {'scpi_cache': True, 'pipeline': True, 'gen_list': True},
+    'trace': {'scpi_cache': True, 'pipeline': True, 'is_trace_mode': True},
+}
+
+
+class CancelToken:
+    cancelled = False
+
+
+class SleepMeter:
+    """Stands in for the `time` module in the controller and settle engine, sums explicit sleeps."""
+
+    def __init__(self):
+        self.total = 0.0
+
+    def __getattr__(self, item):
+        return getattr(time, item)
+
+    def sleep(self, seconds):
+        self.total += seconds
+        time.sleep(seconds)
+
+
+def _deltas(count):
+    deltas = {5: 0.9, 10: 0.82, 20: 0.82, 30: 0.82, 40: 0.82, 50: 0.86, 60: 0.86, 70: 0.86, 80: 0.86, 90: 0.86,
+              100: 0.93, 150: 0.98, 200: 0.99, 250: 1.02, 300: 1.05, 350: 1.1, 400: 1.15, 450: 1.51}
+    if count <= len(deltas):
+        return dict(list(deltas.items())[:count])
+    step = 450 / count
+    return {round(step * (i + 1)): 0.9 for i in range(count)}
+
+
+def _make_controller(grid, variant, time_scale, verbose):
+    lo_count, if_count, u_count = grid
+
+    controller = InstrumentController()
+    controller.rigParams.update({'sim': True, 'sim_time_scale': time_scale})
+    applog.setup({**controller.rigParams, 'log_console': verbose, 'log_file': ''})
+    for key, value in VARIANTS[variant].items():
+        target = controller.secondaryParams if key in controller.secondaryParams else controller.rigParams
+        target[key] = value
+
+    controller.secondaryParams.update({
+        'Flo_min': 1.0,
+        'Flo_max': 1.0 + (lo_count - 1) * 0.5,
+        'Flo_delta': 0.5,
+        'Umin': 4.75,
+        'Umax': 4.75 + (u_count - 1) * 0.05,
+        'Udelta': 0.05,
+    })
+    controller._deltas = _deltas(if_count)
+
+    controller.found = controller._find()
+    controller._init()
+    return controller
+
+
+def _run(controller, name, fn, points, verbose):
+    meter = SleepMeter()
+    instrumentcontroller.time = meter
+    settle.time = meter
+    controller._rig.reset_stats()
+
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            fn()
+    finally:
+        wall = time.perf_counter() - start
+        instrumentcontroller.time = time
+        settle.time = time
+
+    sends = sum(controller._rig.sends.values())
+    queries = sum(controller._rig.queries.values())
+    return {
+        'routine': name,
+        'points': points,
+        'wall_s': round(wall, 3),
+        'points_per_s': round(points / wall, 3) if wall else None,
+        'sends_per_point': round(sends / points, 2),
+        'queries_per_point': round(queries / points, 2),
+        'sleep_s': round(meter.total, 3),
+        'settle_s': round(sum(sum(v) for v in controller._settle.observed.values()), 3),
+    }
+
+
+def run_case(grid, variant, time_scale, verbose=False):
+    lo_count, if_count, u_count = grid
+    controller = _make_controller(grid, variant, time_scale, verbose)
+    token = CancelToken()
+
+    results = [
+        _run(controller, 'calibrate_lo', lambda: controller._calibrateLO(token, None), lo_count, verbose),
+        _run(controller, 'calibrate_rf', lambda: controller._calibrateRF(token, None), lo_count * if_count, verbose),
+        _run(controller, 'measure', lambda: controller.measure(token, ['+25', 0]),
+             lo_count * if_count + u_count, verbose),
+    ]
+    for r in results:
+        r.update({'grid': list(grid), 'variant': variant})
+    return results
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__) or '.',
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Headless sweep benchmark against the simulated rig')
+    parser.add_argument('--quick', action='store_true', help='run a single small grid')
+    parser.add_argument('--variant', action='append', choices=list(VARIANTS), help='variants to run, all by default')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='simulated latency/settle scale')
+    parser.add_argument('--verbose', action='store_true', help='keep the controller log on stdout')
+    parser.add_argument('--out', default='', help='result file, bench/bench-<timestamp>.json by default')
+    opts = parser.parse_args(args[1:])
+
+    out = opts.out or os.path.abspath(f'bench/bench-{datetime.datetime.now().isoformat().replace(":", ".")}.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+
+    revision = _revision()
+    cwd = os.getcwd()
+
+    rows = []
+    try:
+        for grid in QUICK_GRIDS if opts.quick else GRIDS:
+            for variant in opts.variant or VARIANTS:
+                # calibration and measurement write their .ini files into the working dir,
+                # every case starts from a clean one, away from the real configs
+                os.chdir(tempfile.mkdtemp(prefix='demod-bench-'))
+                for row in run_case(grid, variant, opts.time_scale, opts.verbose):
+                    rows.append(row)
+                    print(f'{row["variant"]:>9} {str(row["grid"]):>12} {row["routine"]:>13}: '
+                          f'{row["wall_s"]:8.2f} s {row["points_per_s"]:7.2f} pt/s '
+                          f'{row["sends_per_point"]:6.2f} snd/pt {row["queries_per_point"]:6.2f} qry/pt '
+                          f'sleep {row["sleep_s"]:6.2f} s settle {row["settle_s"]:6.2f} s', file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+
+    with open(out, mode='wt', encoding='utf-8') as f:
+        json.dump({
+            'revision': revision,
+            'date': datetime.datetime.now().isoformat(),
+            'time_scale': opts.time_scale,
+            'results': rows,
+        }, f, indent=2, ensure_ascii=False)
+    print(f'saved {out}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
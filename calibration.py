@@ -0,0 +1,87 @@
+import numpy as np
+
+import applog
+
+from forgot_again.file import load_ast_if_exists
+
+log = applog.get_logger('calibration')
+
+
+def _weights(x, xp):
+    # bracketing indices and linear weights of x on the sorted grid xp, clamped to the grid edges
+    x = np.clip(x, xp[0], xp[-1])
+    hi = np.clip(np.searchsorted(xp, x, side='right'), 1, len(xp) - 1)
+    lo = hi - 1
+    span = xp[hi] - xp[lo]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = np.where(span > 0, (x - xp[lo]) / span, 0.0)
+    return lo, hi, w
+
+
+def spread(values, count):
+    """`count` values picked evenly from `values`, both ends included."""
+    if count >= len(values):
+        return list(values)
+    return [values[i] for i in np.unique(np.linspace(0, len(values) - 1, max(count, 2)).round().astype(int))]
+
+
+class CalibrationModel:
+    """
+    Path losses from cal_lo.ini / cal_rf.ini as sorted arrays.
+
+    LO loss is interpolated linearly over the LO frequency, RF loss over the IF offset within
+    every calibrated LO row and then over LO, so a calibration done on a coarse grid applies to a dense sweep.
+    Outside the calibrated range the edge value is held.
+    """
+
+    def __init__(self, cal_lo=None, cal_rf=None):
+        cal_lo = cal_lo or {}
+        self.lo_freqs = np.array(sorted(cal_lo), dtype=float)
+        self.lo_losses = np.array([cal_lo[k] for k in sorted(cal_lo)], dtype=float)
+
+        cal_rf = {k: v for k, v in (cal_rf or {}).items() if v}
+        self.rf_freqs = np.array(sorted(cal_rf), dtype=float)
+        # rows may have different IF offsets, each row keeps its own grid
+        self.rf_rows = [
+            (np.array(sorted(cal_rf[k]), dtype=float), np.array([cal_rf[k][d] for d in sorted(cal_rf[k])], dtype=float))
+            for k in sorted(cal_rf)
+        ]
+
+    def __bool__(self):
+        return bool(len(self.lo_freqs) and len(self.rf_freqs))
+
+    @classmethod
+    def load(cls, lo_path='cal_lo.ini', rf_path='cal_rf.ini'):
+        return cls(load_ast_if_exists(lo_path, default={}), load_ast_if_exists(rf_path, default={}))
+
+    def lo(self, freqs):
+        """LO loss at each of `freqs`, GHz at the analyzer, i.e. doubled for a x2 LO."""
+        freqs = np.asarray(freqs, dtype=float)
+        if not len(self.lo_freqs):
+            log.warning('no LO calibration, LO power is not corrected')
+            return np.zeros(freqs.shape)
+        self._check_range('LO', freqs, self.lo_freqs)
+        return np.interp(freqs, self.lo_freqs, self.lo_losses)
+
+    def rf(self, freqs_lo, deltas):
+        """RF loss on the grid `freqs_lo` × `deltas` (GHz), shape (len(freqs_lo), len(deltas))."""
+        freqs_lo = np.asarray(freqs_lo, dtype=float)
+        deltas = np.asarray(deltas, dtype=float)
+        if not len(self.rf_freqs):
+            log.warning('no RF calibration, RF power is not corrected')
+            return np.zeros((len(freqs_lo), len(deltas)))
+        self._check_range('RF LO', freqs_lo, self.rf_freqs)
+        self._check_range('RF IF', deltas, np.concatenate([d for d, _ in self.rf_rows]))
+
+        rows = np.array([np.interp(deltas, row_deltas, row_losses) for row_deltas, row_losses in self.rf_rows])
+        lo, hi, w = _weights(freqs_lo, self.rf_freqs)
+        return rows[lo] * (1 - w)[:, None] + rows[hi] * w[:, None]
+
+    @staticmethod
+    def _check_range(name, values, grid):
+        if not len(values):
+            return
+        # half a kHz of slack for the rounding of the grid values
+        if values.min() < grid.min() - 5e-7 or values.max() > grid.max() + 5e-7:
+            log.warning('%s calibration covers %s..%s GHz, sweep needs %s..%s GHz, edge values are used outside',
+                        name, grid.min(), grid.max(), values.min(), values.max())
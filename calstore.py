@@ -0,0 +1,92 @@
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import applog
+
+log = applog.get_logger('calstore')
+
+# GHz keys are compared after rounding, same as the adjustment tables
+_DIGITS = 6
+
+
+def point_key(*values):
+    return tuple(round(float(v), _DIGITS) for v in values)
+
+
+def condition_key(kind, condition):
+    text = json.dumps({'kind': kind, **condition}, sort_keys=True, default=float)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class CalibrationStore:
+    """
+    Calibration points kept across sessions, one JSON file per calibration kind and condition.
+
+    The condition is what changes the measured loss (generator power, x2 mode), the grid is not part of it:
+    every point is stored with its own timestamp, so a wider or denser grid reuses the points it shares
+    with earlier calibrations and only the rest is measured. Points older than `max_age` seconds are ignored.
+    """
+
+    def __init__(self, directory='cal', max_age=None):
+        self.directory = directory
+        self.max_age = max_age
+
+    def path(self, kind, condition):
+        return os.path.join(self.directory, f'{kind}-{condition_key(kind, condition)}.json')
+
+    def points(self, kind, condition):
+        """Valid stored points as {point key: loss}."""
+        now = time.time()
+        return {
+            key: loss for key, (loss, stamp) in self._read(kind, condition).items()
+            if self.max_age is None or now - stamp <= self.max_age
+        }
+
+    def update(self, kind, condition, points):
+        if not points:
+            return
+        now = time.time()
+        stored = self._read(kind, condition)
+        stored.update({point_key(*key): (float(loss), now) for key, loss in points.items()})
+        if self.max_age is not None:
+            stored = {k: v for k, v in stored.items() if now - v[1] <= self.max_age}
+        self._write(kind, condition, stored)
+        log.info('%s: stored %s points, %s total', self.path(kind, condition), len(points), len(stored))
+
+    def discard(self, kind, condition, predicate):
+        """Drops the stored points whose key matches `predicate`, they are measured again on the next calibration."""
+        stored = self._read(kind, condition)
+        kept = {k: v for k, v in stored.items() if not predicate(k)}
+        if len(kept) == len(stored):
+            return
+        self._write(kind, condition, kept)
+        log.info('%s: discarded %s points', self.path(kind, condition), len(stored) - len(kept))
+
+    def _write(self, kind, condition, stored):
+        path = self.path(kind, condition)
+        os.makedirs(self.directory, exist_ok=True)
+        data = {
+            'kind': kind,
+            'condition': condition,
+            'updated': datetime.datetime.now().isoformat(),
+            'points': [[*key, loss, stamp] for key, (loss, stamp) in sorted(stored.items())],
+        }
+        # write aside and swap, a crash mid-write leaves the previous file intact
+        with open(path + '.tmp', mode='wt', encoding='utf-8') as f:
+            json.dump(data, f, default=float)
+        os.replace(path + '.tmp', path)
+
+    def _read(self, kind, condition):
+        path = self.path(kind, condition)
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, mode='rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError:
+            log.warning('%s: unreadable calibration, ignored', path)
+            return {}
+        return {point_key(*row[:-2]): (row[-2], row[-1]) for row in data['points']}
@@ -0,0 +1,57 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+
+class UpdateCoalescer(QObject):
+    """
+    Turns a burst of notify() calls into single `updated` emissions, at most `max_rate` a second.
+
+    The first notification after a quiet period goes out right away, the ones arriving
+    within the next frame are folded into one emission at the end of that frame.
+    """
+
+    updated = pyqtSignal()
+
+    def __init__(self, max_rate=20, parent=None):
+        super().__init__(parent)
+        self._interval = 1.0 / max_rate if max_rate else 0.0
+        self._pending = 0
+        self._emitted_at = 0.0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._emit)
+
+        # points folded into the emissions since reset_stats(), logged when a measurement ends
+        self.notified = 0
+        self.emitted = 0
+
+    @pyqtSlot()
+    def notify(self):
+        self._pending += 1
+        self.notified += 1
+        if self._timer.isActive():
+            return
+        wait = self._interval - (time.monotonic() - self._emitted_at)
+        if wait <= 0:
+            self._emit()
+        else:
+            self._timer.start(int(wait * 1000) + 1)
+
+    @pyqtSlot()
+    def flush(self):
+        """Emits what is pending right away, call when the producer is done."""
+        self._timer.stop()
+        if self._pending:
+            self._emit()
+
+    def reset_stats(self):
+        self.notified = 0
+        self.emitted = 0
+
+    def _emit(self):
+        self._pending = 0
+        self._emitted_at = time.monotonic()
+        self.emitted += 1
+        self.updated.emit()
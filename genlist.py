@@ -0,0 +1,48 @@
+GHz = 1_000_000_000
+
+# models from GeneratorFactory.applicable with hardware list sweep
+LIST_CAPABLE = ['N5183A', 'N5181B', 'E4438C', 'E8257D']
+
+
+class GeneratorList:
+    """
+    Hardware list sweep on a signal generator.
+
+    The whole frequency/power table is uploaded once, afterwards every
+    `step()` is a single *TRG over the bus. With the point trigger on BUS
+    the generator waits for a trigger at every point, including the first one.
+    """
+
+    def __init__(self, generator):
+        self._gen = generator
+        self.size = 0
+
+    @staticmethod
+    def supported(generator):
+        return generator.model.split()[0] in LIST_CAPABLE
+
+    def upload(self, table):
+        freqs, pows = zip(*table)
+        self.size = len(table)
+
+        self._gen.send(':LIST:TYPE LIST')
+        self._gen.send(':LIST:DIR UP')
+        self._gen.send(':LIST:MODE AUTO')
+        self._gen.send(':LIST:TRIG:SOUR BUS')
+        self._gen.send(':TRIG:SOUR IMM')
+        self._gen.send(f':LIST:FREQ {",".join(f"{f * GHz:.0f}" for f in freqs)}')
+        self._gen.send(f':LIST:POW {",".join(f"{p:.2f}" for p in pows)}')
+        self._gen.send(':LIST:DWEL 0.001')
+
+    def start(self):
+        self._gen.send(':INIT:CONT OFF')
+        self._gen.send(':FREQ:MODE LIST')
+        self._gen.send(':POW:MODE LIST')
+        self._gen.send(':INIT')
+
+    def step(self):
+        self._gen.send('*TRG')
+
+    def stop(self):
+        self._gen.send(':FREQ:MODE CW')
+        self._gen.send(':POW:MODE CW')
@@ -1,16 +1,32 @@
 import ast
+import datetime
 import time
 
 import numpy as np
 
+import applog
+
 from collections import defaultdict
+from types import SimpleNamespace
 from PyQt5.QtCore import QObject, pyqtSlot, pyqtSignal
 
 from instr.instrumentfactory import mock_enabled, GeneratorFactory, SourceFactory, \
     MultimeterFactory, AnalyzerFactory
 from measureresult import MeasureResult
+from calibration import CalibrationModel, spread
+from calstore import CalibrationStore, point_key
+from genlist import GeneratorList
+from journal import Journal, find_journal
+from phasetimer import PhaseTimer
+from satrace import parse_trace, tone_levels
+from scheduler import Scheduler, wait_all
+from scpicache import CachedInstrument
+from settle import SettleEngine
+from simrig import SimRig
 from forgot_again.file import load_ast_if_exists, pprint_to_file
 
+log = applog.get_logger('controller')
+
 
 class InstrumentController(QObject):
     pointReady = pyqtSignal()
@@ -48,7 +64,7 @@ class InstrumentController(QObject):
             },
         }
 
-        self.secondaryParams = load_ast_if_exists('params.ini', default={
+        self.secondaryParams = {
             'Usrc': 5.0,
             'UsrcD': 3.3,
             'Flo_min': 1.0,
@@ -64,10 +80,78 @@ class InstrumentController(QObject):
             'Umin': 4.75,
             'Umax': 5.25,
             'Udelta': 0.05,
-        })
+            'is_trace_mode': False,
+            **load_ast_if_exists('params.ini', default={})
+        }
+
+        self.rigParams = {
+            'settle_opc': True,
+            'settle_timeout': {
+                'Анализатор': 0.5,
+                'P LO': 0.5,
+                'P RF': 0.5,
+                'Источник': 0.5,
+                'Мультиметр': 0.5,
+            },
+            'settle_tolerance': {
+                'Анализатор': 0.05,   # dB
+                'Мультиметр': 0.0005,   # A
+            },
+            'settle_poll': 0.05,
+            'settle_reads': 3,
+            'scpi_cache': True,
+            'pipeline': False,
+            'gen_list': False,
+            'trace_points': 2001,
+            'trace_window': 0.0005,   # GHz
+            'sim': False,
+            'sim_latency': {   # s, (write, query)
+                'Анализатор': (0.002, 0.01),
+                'P LO': (0.002, 0.005),
+                'P RF': (0.002, 0.005),
+                'Источник': (0.002, 0.005),
+                'Мультиметр': (0.002, 0.02),
+            },
+            'sim_settle': {   # s
+                'Анализатор': 0.05,
+                'P LO': 0.05,
+                'P RF': 0.05,
+                'Источник': 0.1,
+                'DUT': 0.15,
+            },
+            'sim_noise': 0.01,   # dB
+            'sim_time_scale': 1.0,
+            'log_level': 'INFO',   # DEBUG dumps every point
+            'log_console': True,
+            'log_file': 'log/demod.log',
+            'log_max_bytes': 5_000_000,
+            'log_backups': 5,
+            'journal_dir': 'journal',
+            'journal_sync_every': 20,   # points
+            'journal_sync_interval': 2.0,   # s
+            'adjust_nearest': False,   # apply the closest adjustment point when there is no exact one
+            'adjust_tolerance': (0.5, 0.5, 0.01, 0.01),   # p_lo dBm, p_rf dBm, f_lo GHz, f_rf GHz
+            'cal_lo_step': None,   # GHz, calibration LO step, None to calibrate at every sweep LO point
+            'cal_if_every': 1,   # calibrate every n-th IF offset, the rest is interpolated
+            'cal_reuse': True,   # take still valid points from the calibration store instead of measuring them
+            'cal_dir': 'cal',
+            'cal_max_age': 24 * 3600,   # s, stored calibration points expire after that, None to keep forever
+            'cal_check_lo': 5,   # LO rows measured by the calibration check
+            'cal_check_if': 3,   # IF offsets measured per checked row
+            'cal_drift_threshold': 0.3,   # dB
+            'cal_drift_recalibrate': 'region',   # 'region', 'full' or None to only report the drift
+            'gui_max_fps': 20,   # plot and report refreshes per second while measuring
+            'plot_max_symbols': 2000,   # points in view above which the plots drop the point markers
+            **load_ast_if_exists('rig.ini', default={})
+        }
+
+        applog.setup(self.rigParams)
+
+        self._settle = SettleEngine(self.rigParams)
 
-        self._calibrated_pows_lo = load_ast_if_exists('cal_lo.ini', default={})
-        self._calibrated_pows_rf = load_ast_if_exists('cal_rf.ini', default={})
+        self._calibration = CalibrationModel.load('cal_lo.ini', 'cal_rf.ini')
+        self._cal_store = CalibrationStore(self.rigParams['cal_dir'], self.rigParams['cal_max_age'])
+        self.calibrationDrift = dict()
 
         self._deltas = load_ast_if_exists('deltas.ini', default={
             5: 0.9, 10: 0.82, 20: 0.82, 30: 0.82, 40: 0.82, 50: 0.86,
@@ -76,40 +160,53 @@ class InstrumentController(QObject):
         })
 
         self._instruments = dict()
+        self._rig = None
         self.found = False
         self.present = False
         self.hasResult = False
 
         self.result = MeasureResult()
+        self.result.adjust_nearest = self.rigParams['adjust_nearest']
+        self.result.adjust_tolerance = self.rigParams['adjust_tolerance']
 
     def __str__(self):
         return f'{self._instruments}'
 
     def connect(self, addrs):
-        print(f'searching for {addrs}')
+        log.info('searching for %s', addrs)
         for k, v in addrs.items():
             self.requiredInstruments[k].addr = v
         self.found = self._find()
 
     def _find(self):
-        self._instruments = {
-            k: v.find() for k, v in self.requiredInstruments.items()
-        }
+        if self.rigParams['sim']:
+            self._rig = SimRig(self.rigParams)
+            self._instruments = self._rig.instruments()
+        else:
+            self._instruments = {
+                k: v.find() for k, v in self.requiredInstruments.items()
+            }
+        if self.rigParams['scpi_cache']:
+            self._instruments = {
+                k: CachedInstrument(v) if v else v for k, v in self._instruments.items()
+            }
         return all(self._instruments.values())
 
     def check(self, token, params):
-        print(f'call check with {token} {params}')
+        log.info('call check with %s %s', token, params)
         device, secondary = params
         self.present = self._check(token, device, secondary)
-        print('sample pass')
+        log.info('sample pass')
 
     def _check(self, token, device, secondary):
-        print(f'launch check with {self.deviceParams[device]} {self.secondaryParams}')
+        log.info('launch check with %s %s', self.deviceParams[device], self.secondaryParams)
         self._init()
         return True
 
     def _calibrateLO(self, token, secondary):
-        print('run calibrate LO with', secondary)
+        log.info('run calibrate LO with %s', secondary)
+        self._settle.reset()
+        self._reset_scpi_cache()
 
         gen_lo = self._instruments['P LO']
         sa = self._instruments['Анализатор']
@@ -118,14 +215,12 @@ class InstrumentController(QObject):
 
         pow_lo = secondary['Plo']
         freq_lo_start = secondary['Flo_min']
-        freq_lo_end = secondary['Flo_max']
-        freq_lo_step = secondary['Flo_delta']
         freq_lo_x2 = secondary['is_Flo_x2']
 
-        freq_lo_values = [round(x, 3) for x in
-                          np.arange(start=freq_lo_start, stop=freq_lo_end + 0.0001, step=freq_lo_step)]
+        freq_lo_values, _ = self._calibration_grid(secondary)
 
         sa.send(':CAL:AUTO OFF')
+        sa.send(':INIT:CONT OFF')
         sa.send(':SENS:FREQ:SPAN 1MHz')
         sa.send(f'DISP:WIND:TRAC:Y:RLEV 10')
         sa.send(f'DISP:WIND:TRAC:Y:PDIV 5')
@@ -134,139 +229,509 @@ class InstrumentController(QObject):
         gen_lo.send(f':OUTP:MOD:STAT OFF')
         gen_lo.send(f'SOUR:POW {pow_lo}dbm')
 
+        stored = self._stored_calibration('lo', secondary)
         result = {}
-        for freq in freq_lo_values:
+        with Scheduler({'P LO': gen_lo, 'Анализатор': sa}, pipelined=self.rigParams['pipeline']) as sched:
+            q_lo = sched['P LO']
+            q_sa = sched['Анализатор']
 
-            if freq_lo_x2:
-                freq *= 2
+            for freq in freq_lo_values:
 
-            if token.cancelled:
-                gen_lo.send(f'OUTP:STAT OFF')
-                time.sleep(0.5)
+                if freq_lo_x2:
+                    freq *= 2
 
-                gen_lo.send(f'SOUR:POW {pow_lo}dbm')
+                if token.cancelled:
+                    self._store_calibration('lo', secondary, result, stored)
+                    gen_lo.send(f'OUTP:STAT OFF')
+                    sa.send(':INIT:CONT ON')
+                    time.sleep(0.5)
 
-                gen_lo.send(f'SOUR:FREQ {freq_lo_start}GHz')
-                raise RuntimeError('calibration cancelled')
+                    gen_lo.send(f'SOUR:POW {pow_lo}dbm')
 
-            gen_lo.send(f'SOUR:FREQ {freq}GHz')
-            gen_lo.send(f'OUTP:STAT ON')
+                    gen_lo.send(f'SOUR:FREQ {freq_lo_start}GHz')
+                    raise RuntimeError('calibration cancelled')
 
-            if not mock_enabled:
-                time.sleep(0.35)
+                if point_key(freq) in stored:
+                    result[freq] = stored[point_key(freq)]
+                    continue
 
-            sa.send(f':SENSe:FREQuency:CENTer {freq}GHz')
-            sa.send(f':CALCulate:MARKer1:X:CENTer {freq}GHz')
+                # generator and analyzer retune don't depend on each other, pipelined they run alongside
+                q_lo.send(f'SOUR:FREQ {freq}GHz')
+                q_lo.send(f'OUTP:STAT ON')
+                lo_ready = q_lo.submit(self._settle.wait, 'P LO', gen_lo, fixed=0.35)
 
-            if not mock_enabled:
-                time.sleep(0.35)
+                q_sa.send(f':SENSe:FREQuency:CENTer {freq}GHz')
+                q_sa.send(f':CALCulate:MARKer1:X:CENTer {freq}GHz')
+                sa_ready = q_sa.submit(self._settle.wait, 'Анализатор', sa, fixed=0.35)
 
-            pow_read = float(sa.query(':CALCulate:MARKer:Y?'))
-            loss = abs(pow_lo - pow_read)
-            if mock_enabled:
-                loss = 10
+                wait_all(lo_ready, sa_ready)
+
+                pow_read = q_sa.submit(
+                    self._settle.read_stable, 'Анализатор', sa, ':CALCulate:MARKer:Y?', trigger=True).result()
+                loss = abs(pow_lo - pow_read)
+                if mock_enabled:
+                    loss = 10
 
-            print('loss: ', loss)
-            result[freq] = loss
+                log.debug('loss: %s', loss)
+                result[freq] = loss
 
+        self._store_calibration('lo', secondary, result, stored)
         pprint_to_file('cal_lo.ini', result)
+        self._save_settle_stats()
 
         gen_lo.send(f'OUTP:STAT OFF')
         sa.send(':CAL:AUTO ON')
-        self._calibrated_pows_lo = result
+        sa.send(':INIT:CONT ON')
+        self._calibration = CalibrationModel(result, self._calibration_table_rf())
         return True
 
     def _calibrateRF(self, token, secondary):
-        print('run calibrate RF with', secondary)
+        log.info('run calibrate RF with %s', secondary)
+        self._settle.reset()
+        self._reset_scpi_cache()
 
         gen_rf = self._instruments['P RF']
         sa = self._instruments['Анализатор']
 
         secondary = self.secondaryParams
 
-        freq_lo_start = secondary['Flo_min']
-        freq_lo_end = secondary['Flo_max']
-        freq_lo_step = secondary['Flo_delta']
-
-        pow_lo = secondary['Plo']
         pow_rf = secondary['Prf']
 
-        freq_lo_values = [round(x, 3) for x in np.arange(start=freq_lo_start, stop=freq_lo_end + 0.002, step=freq_lo_step)]
-        freq_rf_deltas_and_losses = [[k / 1_000, v] for k, v in self._deltas.items()]
+        freq_lo_values, freq_rf_deltas_and_losses = self._calibration_grid(secondary)
 
         sa.send(':CAL:AUTO OFF')
+        sa.send(':INIT:CONT OFF')
         sa.send(':SENS:FREQ:SPAN 1MHz')
         sa.send(f'DISP:WIND:TRAC:Y:RLEV 10')
         sa.send(f'DISP:WIND:TRAC:Y:PDIV 5')
         sa.send(':CALC:MARK1:MODE POS')
 
+        stored = self._stored_calibration('rf', secondary)
         result = defaultdict(dict)
 
-        for freq_lo in freq_lo_values:
-            for freq_rf_delta, loss in freq_rf_deltas_and_losses:
+        with Scheduler({'P RF': gen_rf, 'Анализатор': sa}, pipelined=self.rigParams['pipeline']) as sched:
+            q_rf = sched['P RF']
+            q_sa = sched['Анализатор']
 
-                if token.cancelled:
-                    gen_rf.send(f'OUTP:STAT OFF')
+            for freq_lo in freq_lo_values:
+                for freq_rf_delta, loss in freq_rf_deltas_and_losses:
 
-                    time.sleep(0.5)
+                    if token.cancelled:
+                        self._store_calibration('rf', secondary, result, stored)
+                        gen_rf.send(f'OUTP:STAT OFF')
+                        sa.send(':INIT:CONT ON')
 
-                    gen_rf.send(f'SOUR:POW {pow_rf}dbm')
-                    gen_rf.send(f'SOUR:FREQ {freq_rf_deltas_and_losses[0][0]}GHz')
-                    raise RuntimeError('calibration cancelled')
+                        time.sleep(0.5)
 
-                freq_rf = freq_lo + freq_rf_delta
-                gen_rf.send(f'SOUR:FREQ {freq_rf}GHz')
-                gen_rf.send(f'SOUR:POW {pow_rf}dbm')
-                gen_rf.send(f'OUTP:STAT ON')
+                        gen_rf.send(f'SOUR:POW {pow_rf}dbm')
+                        gen_rf.send(f'SOUR:FREQ {freq_rf_deltas_and_losses[0][0]}GHz')
+                        raise RuntimeError('calibration cancelled')
 
-                if not mock_enabled:
-                    time.sleep(0.35)
+                    if point_key(freq_lo, freq_rf_delta) in stored:
+                        result[freq_lo][freq_rf_delta] = stored[point_key(freq_lo, freq_rf_delta)]
+                        continue
 
-                center_freq = freq_rf
-                sa.send(f':SENSe:FREQuency:CENTer {center_freq}GHz')
-                sa.send(f':CALCulate:MARKer1:X:CENTer {center_freq}GHz')
+                    freq_rf = freq_lo + freq_rf_delta
+                    q_rf.send(f'SOUR:FREQ {freq_rf}GHz')
+                    q_rf.send(f'SOUR:POW {pow_rf}dbm')
+                    q_rf.send(f'OUTP:STAT ON')
+                    rf_ready = q_rf.submit(self._settle.wait, 'P RF', gen_rf, fixed=0.35)
 
-                if not mock_enabled:
-                    time.sleep(0.35)
+                    center_freq = freq_rf
+                    q_sa.send(f':SENSe:FREQuency:CENTer {center_freq}GHz')
+                    q_sa.send(f':CALCulate:MARKer1:X:CENTer {center_freq}GHz')
+                    sa_ready = q_sa.submit(self._settle.wait, 'Анализатор', sa, fixed=0.35)
 
-                pow_read = float(sa.query(':CALCulate:MARKer:Y?'))
-                loss = abs(pow_rf - pow_read)
-                if mock_enabled:
-                    loss = 10
+                    wait_all(rf_ready, sa_ready)
 
-                print('loss: ', loss)
-                result[freq_lo][freq_rf_delta] = loss
+                    pow_read = q_sa.submit(
+                        self._settle.read_stable, 'Анализатор', sa, ':CALCulate:MARKer:Y?', trigger=True).result()
+                    loss = abs(pow_rf - pow_read)
+                    if mock_enabled:
+                        loss = 10
+
+                    log.debug('loss: %s', loss)
+                    result[freq_lo][freq_rf_delta] = loss
 
         result = {k: v for k, v in result.items()}
+        self._store_calibration('rf', secondary, result, stored)
         pprint_to_file('cal_rf.ini', result)
+        self._save_settle_stats()
 
         gen_rf.send(f'OUTP:STAT OFF')
         sa.send(':CAL:AUTO ON')
-        self._calibrated_pows_rf = result
+        sa.send(':INIT:CONT ON')
+        self._calibration = CalibrationModel(self._calibration_table_lo(), result)
+        return True
+
+    def _calibrateBoth(self, token, secondary):
+        log.info('run calibrate LO+RF with %s', secondary)
+        self._settle.reset()
+        self._reset_scpi_cache()
+
+        secondary = self.secondaryParams
+
+        freq_lo_values, freq_rf_deltas_and_losses = self._calibration_grid(secondary)
+
+        stored_lo = self._stored_calibration('lo', secondary)
+        stored_rf = self._stored_calibration('rf', secondary)
+        result_lo = {}
+        result_rf = defaultdict(dict)
+        rows = list(self._combined_rows(
+            secondary, freq_lo_values, freq_rf_deltas_and_losses, stored_lo, stored_rf, result_lo, result_rf))
+        try:
+            self._combined_pass(token, secondary, rows, result_lo, result_rf)
+        finally:
+            # a cancelled calibration keeps the points measured so far
+            result_rf = {k: v for k, v in result_rf.items()}
+            self._store_calibration('lo', secondary, result_lo, stored_lo)
+            self._store_calibration('rf', secondary, result_rf, stored_rf)
+
+        pprint_to_file('cal_lo.ini', result_lo)
+        pprint_to_file('cal_rf.ini', result_rf)
+        self._save_settle_stats()
+
+        self._calibration = CalibrationModel(result_lo, result_rf)
         return True
 
+    def _verifyCalibration(self, token, secondary):
+        log.info('run calibration check with %s', secondary)
+        self._settle.reset()
+        self._reset_scpi_cache()
+
+        secondary = self.secondaryParams
+        freq_lo_x2 = secondary['is_Flo_x2']
+        threshold = self.rigParams['cal_drift_threshold']
+
+        if not self._calibration:
+            log.warning('calibration check: nothing to check against, running a full calibration')
+            return self._calibrateBoth(token, secondary)
+
+        freq_lo_values, freq_rf_deltas_and_losses = self._calibration_grid(secondary)
+        check_lo = spread(freq_lo_values, self.rigParams['cal_check_lo'])
+        check_if = spread([d for d, _ in freq_rf_deltas_and_losses], self.rigParams['cal_check_if'])
+
+        result_lo = {}
+        result_rf = defaultdict(dict)
+        rows = [(freq_lo, freq_lo * 2 if freq_lo_x2 else freq_lo, check_if, True) for freq_lo in check_lo]
+        self._combined_pass(token, secondary, rows, result_lo, result_rf)
+        self._save_settle_stats()
+
+        drift = self._calibration_drift(result_lo, result_rf, freq_lo_x2)
+        drifted = sorted(freq_lo for freq_lo, value in drift['rows'].items() if value > threshold)
+        drift['threshold'] = threshold
+        drift['drifted'] = drifted
+        self.calibrationDrift = drift
+        pprint_to_file('cal_check.ini', drift)
+
+        log.info('calibration check: LO drift %s dB, RF drift %s dB at %s points, threshold %s dB',
+                 drift['max_lo'], drift['max_rf'], len(result_lo) + len(check_lo) * len(check_if), threshold)
+        if not drifted:
+            return True
+
+        action = self.rigParams['cal_drift_recalibrate']
+        if not action:
+            log.warning('calibration check: drift over threshold at LO %s GHz, recalibration is off', drifted)
+            return True
+
+        if action == 'full':
+            regions = [(freq_lo_values[0], freq_lo_values[-1])]
+        else:
+            # everything between the neighbouring checked rows may have moved as well
+            regions = []
+            for freq_lo in drifted:
+                pos = check_lo.index(freq_lo)
+                regions.append((check_lo[max(pos - 1, 0)], check_lo[min(pos + 1, len(check_lo) - 1)]))
+        log.warning('calibration check: drift over threshold at LO %s GHz, recalibrating %s', drifted, regions)
+
+        if action != 'full' and not self.rigParams['cal_reuse']:
+            log.warning('calibration check: cal_reuse is off, the recalibration measures the full grid')
+        else:
+            self._seed_calibration(secondary, regions)
+        self._discard_calibration(secondary, regions)
+        return self._calibrateBoth(token, secondary)
+
+    def _calibration_drift(self, result_lo, result_rf, freq_lo_x2):
+        # measured minus stored loss, the stored one is interpolated where the check is off the calibration grid
+        freqs_lo_out = list(result_lo)
+        drift_lo = np.array([result_lo[f] for f in freqs_lo_out]) - self._calibration.lo(freqs_lo_out)
+
+        freqs_lo = list(result_rf)
+        deltas = list(result_rf[freqs_lo[0]]) if freqs_lo else []
+        measured_rf = np.array([[result_rf[f][d] for d in deltas] for f in freqs_lo]).reshape(len(freqs_lo), len(deltas))
+        drift_rf = measured_rf - self._calibration.rf(freqs_lo, deltas)
+
+        # worst drift per LO row, LO and RF together
+        rows = {}
+        for freq_lo_out, value in zip(freqs_lo_out, np.abs(drift_lo).tolist()):
+            freq_lo = freq_lo_out / 2 if freq_lo_x2 else freq_lo_out
+            rows[freq_lo] = max(rows.get(freq_lo, 0.0), round(value, 3))
+        for freq_lo, row in zip(freqs_lo, np.abs(drift_rf).tolist()):
+            rows[freq_lo] = max(rows.get(freq_lo, 0.0), round(max(row, default=0.0), 3))
+
+        return {
+            'lo': dict(zip(freqs_lo_out, np.round(drift_lo, 3).tolist())),
+            'rf': {f: dict(zip(deltas, row)) for f, row in zip(freqs_lo, np.round(drift_rf, 3).tolist())},
+            'rows': rows,
+            'max_lo': round(float(np.abs(drift_lo).max(initial=0.0)), 3),
+            'max_rf': round(float(np.abs(drift_rf).max(initial=0.0)), 3),
+        }
+
+    def _seed_calibration(self, secondary, regions):
+        # the check confirmed the current calibration outside `regions`, grid points the store lost
+        # (expired or never stored) get its values, so only the drifted regions are measured again
+        freq_lo_x2 = secondary['is_Flo_x2']
+        freq_lo_values, freq_rf_deltas_and_losses = self._calibration_grid(secondary)
+        kept = [freq_lo for freq_lo in freq_lo_values if not _in_regions(freq_lo, regions)]
+        if not kept:
+            return
+        deltas = [d for d, _ in freq_rf_deltas_and_losses]
+        freqs_lo_out = [freq_lo * 2 if freq_lo_x2 else freq_lo for freq_lo in kept]
+
+        points_lo = {point_key(f): loss for f, loss in zip(freqs_lo_out, self._calibration.lo(freqs_lo_out).tolist())}
+        points_rf = {
+            point_key(freq_lo, d): loss
+            for freq_lo, row in zip(kept, self._calibration.rf(kept, deltas).tolist()) for d, loss in zip(deltas, row)
+        }
+        for kind, points in (('lo', points_lo), ('rf', points_rf)):
+            stored = self._stored_calibration(kind, secondary)
+            seeded = {k: v for k, v in points.items() if k not in stored}
+            if seeded:
+                log.info('calibration check: %s %s points taken from the current calibration', len(seeded), kind)
+                self._cal_store.update(kind, self._calibration_condition(kind, secondary), seeded)
+
+    def _discard_calibration(self, secondary, regions):
+        freq_lo_x2 = secondary['is_Flo_x2']
+
+        self._cal_store.discard('lo', self._calibration_condition('lo', secondary),
+                                lambda key: _in_regions(key[0] / 2 if freq_lo_x2 else key[0], regions))
+        self._cal_store.discard('rf', self._calibration_condition('rf', secondary),
+                                lambda key: _in_regions(key[0], regions))
+
+    def _combined_pass(self, token, secondary, rows, result_lo, result_rf):
+        # rows: (freq_lo, LO frequency at the analyzer, IF offsets, whether to read the LO loss)
+        gen_lo = self._instruments['P LO']
+        gen_rf = self._instruments['P RF']
+        sa = self._instruments['Анализатор']
+
+        pow_lo = secondary['Plo']
+        pow_rf = secondary['Prf']
+
+        self._start_combined_calibration(gen_lo, gen_rf, sa, secondary)
+
+        instruments = {'P LO': gen_lo, 'P RF': gen_rf, 'Анализатор': sa}
+        with Scheduler(instruments, pipelined=self.rigParams['pipeline']) as sched:
+            q_lo = sched['P LO']
+            q_rf = sched['P RF']
+            q_sa = sched['Анализатор']
+
+            for freq_lo, freq_lo_out, deltas, need_lo in rows:
+
+                if token.cancelled:
+                    self._cancel_combined_calibration(gen_lo, gen_rf, sa, secondary)
+
+                # one analyzer setup per LO row, the span holds the LO tone and every RF tone of the row
+                center, span = self._combined_span(freq_lo_out, [freq_lo + d for d in deltas])
+
+                q_lo.send(f'SOUR:FREQ {freq_lo_out}GHz')
+                q_lo.send(f'OUTP:STAT ON')
+                lo_ready = q_lo.submit(self._settle.wait, 'P LO', gen_lo, fixed=0.35)
+
+                q_sa.send(f':SENS:FREQ:SPAN {span}GHz')
+                q_sa.send(f':SENSe:FREQuency:CENTer {center}GHz')
+                q_sa.send(f':CALCulate:MARKer1:X:CENTer {freq_lo_out}GHz')
+                sa_ready = q_sa.submit(self._settle.wait, 'Анализатор', sa, fixed=0.35)
+
+                wait_all(lo_ready, sa_ready)
+
+                if need_lo:
+                    pow_read = q_sa.submit(
+                        self._settle.read_stable, 'Анализатор', sa, ':CALCulate:MARKer1:Y?', trigger=True).result()
+                    loss = abs(pow_lo - pow_read)
+                    if mock_enabled:
+                        loss = 10
+
+                    log.debug('loss LO: %s', loss)
+                    result_lo[freq_lo_out] = loss
+
+                for freq_rf_delta in deltas:
+
+                    if token.cancelled:
+                        self._cancel_combined_calibration(gen_lo, gen_rf, sa, secondary)
+
+                    freq_rf = freq_lo + freq_rf_delta
+                    q_rf.send(f'SOUR:FREQ {freq_rf}GHz')
+                    q_rf.send(f'OUTP:STAT ON')
+                    rf_ready = q_rf.submit(self._settle.wait, 'P RF', gen_rf, fixed=0.35)
+
+                    q_sa.send(f':CALCulate:MARKer2:X:CENTer {freq_rf}GHz')
+                    sa_ready = q_sa.submit(self._settle.wait, 'Анализатор', sa, fixed=0.35)
+
+                    wait_all(rf_ready, sa_ready)
+
+                    pow_read = q_sa.submit(
+                        self._settle.read_stable, 'Анализатор', sa, ':CALCulate:MARKer2:Y?', trigger=True).result()
+                    loss = abs(pow_rf - pow_read)
+                    if mock_enabled:
+                        loss = 10
+
+                    log.debug('loss RF: %s', loss)
+                    result_rf[freq_lo][freq_rf_delta] = loss
+
+        self._stop_combined_calibration(gen_lo, gen_rf, sa)
+
+    def _combined_rows(self, secondary, freq_lo_values, freq_rf_deltas_and_losses,
+                       stored_lo, stored_rf, result_lo, result_rf):
+        # fills in the stored points and yields the rows of _combined_pass with what is left to measure
+        freq_lo_x2 = secondary['is_Flo_x2']
+        for freq_lo in freq_lo_values:
+            freq_lo_out = freq_lo * 2 if freq_lo_x2 else freq_lo
+
+            need_lo = point_key(freq_lo_out) not in stored_lo
+            if not need_lo:
+                result_lo[freq_lo_out] = stored_lo[point_key(freq_lo_out)]
+
+            deltas = []
+            for freq_rf_delta, _ in freq_rf_deltas_and_losses:
+                if point_key(freq_lo, freq_rf_delta) in stored_rf:
+                    result_rf[freq_lo][freq_rf_delta] = stored_rf[point_key(freq_lo, freq_rf_delta)]
+                else:
+                    deltas.append(freq_rf_delta)
+
+            if need_lo or deltas:
+                yield freq_lo, freq_lo_out, deltas, need_lo
+
+    def _combined_span(self, freq_lo, freqs_rf):
+        # every tone in one span, with a margin so none sits on the span edge
+        margin = 0.005
+        low = min([freq_lo, *freqs_rf]) - margin
+        high = max([freq_lo, *freqs_rf]) + margin
+        return round((low + high) / 2, 6), round(high - low, 6)
+
+    def _start_combined_calibration(self, gen_lo, gen_rf, sa, secondary):
+        sa.send(':CAL:AUTO OFF')
+        sa.send(':INIT:CONT OFF')
+        sa.send(f'DISP:WIND:TRAC:Y:RLEV 10')
+        sa.send(f'DISP:WIND:TRAC:Y:PDIV 5')
+        sa.send(':CALC:MARK1:MODE POS')
+        sa.send(':CALC:MARK2:MODE POS')
+
+        gen_lo.send(f':OUTP:MOD:STAT OFF')
+        gen_lo.send(f'SOUR:POW {secondary["Plo"]}dbm')
+        gen_rf.send(f'SOUR:POW {secondary["Prf"]}dbm')
+
+    def _stop_combined_calibration(self, gen_lo, gen_rf, sa):
+        gen_lo.send(f'OUTP:STAT OFF')
+        gen_rf.send(f'OUTP:STAT OFF')
+        sa.send(':CALC:MARK2:MODE OFF')
+        sa.send(':CAL:AUTO ON')
+        sa.send(':INIT:CONT ON')
+
+    def _cancel_combined_calibration(self, gen_lo, gen_rf, sa, secondary):
+        self._stop_combined_calibration(gen_lo, gen_rf, sa)
+        time.sleep(0.5)
+
+        gen_lo.send(f'SOUR:POW {secondary["Plo"]}dbm')
+        gen_rf.send(f'SOUR:POW {secondary["Prf"]}dbm')
+        gen_lo.send(f'SOUR:FREQ {secondary["Flo_min"]}GHz')
+        raise RuntimeError('calibration cancelled')
+
     def measure(self, token, params):
-        print(f'call measure with {token} {params}')
-        device, _ = params
+        log.info('call measure with %s %s', token, params)
+        device, options = params
+        resume = bool(options) and options.get('resume', False)
         try:
             self.result.set_secondary_params(self.secondaryParams)
             self.result.set_primary_params(self.deviceParams[device])
-            self._measure(token, device)
+            self._measure(token, device, resume)
             # self.hasResult = bool(self.result)
             self.hasResult = True  # HACK
         except RuntimeError as ex:
-            print('runtime error:', ex)
+            log.error('runtime error: %s', ex)
 
-    def _measure(self, token, device):
+    def _measure(self, token, device, resume=False):
         param = self.deviceParams[device]
         secondary = self.secondaryParams
-        print(f'launch measure with {token} {param} {secondary}')
-
-        self._clear()
-        _, i_res = self._measure_s_params(token, param, secondary)
-        self.result.process_i(i_res)
+        log.info('launch measure with %s %s %s', token, param, secondary)
+
+        done = set()
+        path = find_journal(self.rigParams['journal_dir'], self._journal_header(device, param, secondary)) \
+            if resume else None
+        if path:
+            self.result.load_journal(path)
+            # a run cancelled before its first point leaves a journal with only the header
+            if self.result.count:
+                self.pointReady.emit()
+            done = self.result.measured_indices
+            journal = self._open_journal(path)
+            log.info('resuming %s, %s points already measured', path, len(done))
+        else:
+            if resume:
+                log.info('nothing to resume for %s, starting over', device)
+            self._clear()
+            journal = self._new_journal(device, param, secondary)
+
+        self._settle.reset()
+        self._reset_scpi_cache()
+        self.result.open_journal(journal)
+        try:
+            i_res = self._measure_s_params(token, param, secondary, done)
+            self.result.process_i(i_res)
+        finally:
+            self.result.close_journal()
+            self._save_settle_stats()
+            self._print_scpi_stats()
+            self._print_phase_summary()
         return True
 
+    def _open_journal(self, path):
+        return Journal(
+            path,
+            sync_every=self.rigParams['journal_sync_every'],
+            sync_interval=self.rigParams['journal_sync_interval'],
+        )
+
+    def _new_journal(self, device, param, secondary):
+        journal = self._open_journal(Journal.new_path(self.rigParams['journal_dir'], device))
+        journal.write_header({
+            **self._journal_header(device, param, secondary),
+            'started': datetime.datetime.now().isoformat(),
+        })
+        log.info('journal: %s', journal.path)
+        return journal
+
+    def _journal_header(self, device, param, secondary):
+        # a journal can be resumed only by a run with the same header
+        return {
+            'device': device,
+            'primary': param,
+            'secondary': dict(secondary),
+            'deltas': list(self._deltas.items()),
+        }
+
+    def _save_settle_stats(self):
+        if not self._settle.observed:
+            return
+        log.info('settle: saved %s s against fixed delays', self._settle.saved)
+        self._settle.save('settle.ini')
+
+    def _reset_scpi_cache(self):
+        # the boxes may have been touched from the front panel since the last run,
+        # only sends repeated within this run are dropped
+        for instr in self._instruments.values():
+            if isinstance(instr, CachedInstrument):
+                instr.invalidate()
+                instr.reset_stats()
+
+    def _print_scpi_stats(self):
+        for name, instr in self._instruments.items():
+            if isinstance(instr, CachedInstrument):
+                log.info('scpi cache: %s dropped %s of %s sends', name, instr.dropped, instr.sent + instr.dropped)
+
+    def _print_phase_summary(self):
+        for phase, stats in self.result.timing_summary.items():
+            log.info('timing: %12s %s', phase, ' '.join(f'{k}={v}' for k, v in stats.items()))
+
     def _clear(self):
         self.result.clear()
 
@@ -277,43 +742,169 @@ class InstrumentController(QObject):
         self._instruments['Мультиметр'].send('*RST')
         self._instruments['Анализатор'].send('*RST')
 
-    def _measure_s_params(self, token, param, secondary):
-        gen_lo = self._instruments['P LO']
-        gen_rf = self._instruments['P RF']
-        src = self._instruments['Источник']
-        mult = self._instruments['Мультиметр']
-        sa = self._instruments['Анализатор']
-
-        src_u = secondary['Usrc']
+    def _measure_s_params(self, token, param, secondary, done=frozenset()):
+        sweep = self._start_sweep(secondary, done)
+        gen_lo, gen_rf, src, mult, sa = sweep.gen_lo, sweep.gen_rf, sweep.src, sweep.mult, sweep.sa
+
+        with Scheduler(self._instruments, pipelined=self.rigParams['pipeline']) as sched:
+            q_lo = sched['P LO']
+            q_rf = sched['P RF']
+            q_src = sched['Источник']
+            q_mult = sched['Мультиметр']
+            q_sa = sched['Анализатор']
+
+            # point N is handed to the result while the instruments already retune for point N+1,
+            # in trace mode the whole LO row is handed over after the trace is read
+            pending = []
+            cancelled = False
+
+            for lo_index, freq_lo in enumerate(sweep.freq_lo_values):
+                if lo_index not in sweep.lo_rows:
+                    continue
+
+                freq_lo_label = float(freq_lo)
+                if sweep.freq_lo_x2:
+                    freq_lo *= 2
+                    freq_lo_label *= 2
+
+                _, lo_pow = sweep.lo_table[lo_index]
+                if sweep.lo_list is not None:
+                    q_lo.submit(sweep.lo_step)
+                else:
+                    q_lo.submit(sweep.lo_send, f'SOUR:FREQ {freq_lo}GHz')
+
+                if sweep.trace_mode:
+                    q_sa.submit(sweep.sa_send, ':TRAC1:MODE WRIT')
+                    q_sa.submit(sweep.sa_send, ':TRAC1:MODE MAXH')
+
+                for if_index, (freq_rf_delta, loss) in enumerate(sweep.freq_rf_deltas_and_losses):
+                    point_index = lo_index * len(sweep.freq_rf_deltas_and_losses) + if_index
+                    if point_index in sweep.done:
+                        continue
+
+                    if token.cancelled:
+                        cancelled = True
+                        break
+
+                    freq_rf, rf_pow = sweep.rf_table[point_index]
+                    if sweep.lo_list is None:
+                        q_lo.submit(sweep.lo_send, f'SOUR:POW {lo_pow}dbm')
+                    if sweep.rf_list is not None:
+                        q_rf.submit(sweep.rf_step)
+                    else:
+                        q_rf.submit(sweep.rf_send, f'SOUR:POW {rf_pow}dbm')
+                        q_rf.submit(sweep.rf_send, f'SOUR:FREQ {freq_rf}GHz')
+
+                    q_src.submit(sweep.src_send, 'OUTPut ON')
+
+                    q_lo.submit(sweep.lo_send, f'OUTP:STAT ON')
+                    q_rf.submit(sweep.rf_send, f'OUTP:STAT ON')
+
+                    lo_ready = q_lo.submit(sweep.settle, 'P LO', gen_lo, fixed=0.0)
+                    rf_ready = q_rf.submit(sweep.settle, 'P RF', gen_rf, fixed=0.0)
+                    src_ready = q_src.submit(sweep.settle, 'Источник', src, fixed=0.51)
+
+                    if sweep.trace_mode:
+                        wait_all(lo_ready, rf_ready, src_ready)
+
+                        i_mul_read = q_mult.submit(sweep.mult_read, 'Мультиметр', mult, 'MEAS:CURR:DC? 1A,DEF')
+                        swept = q_sa.submit(sweep.trace_sweep, sa)
+                        wait_all(i_mul_read, swept)
+                        pow_read = None
+                    else:
+                        # analyzer retune doesn't depend on the generators, run it alongside
+                        center_freq = freq_rf_delta
+                        offset = 0 if not sweep.d else freq_rf_delta * 1_000 / 2
+                        q_sa.submit(sweep.sa_send, f'DISP:WIND:TRAC:X:OFFS {offset}MHz')
+                        q_sa.submit(sweep.sa_send, ':CALC:MARK1:MODE POS')
+                        q_sa.submit(sweep.sa_send, f':SENSe:FREQuency:CENTer {center_freq}GHz')
+                        q_sa.submit(sweep.sa_send, f':CALCulate:MARKer1:X:CENTer {center_freq}GHz')
+                        sa_ready = q_sa.submit(sweep.settle, 'Анализатор', sa, fixed=0.5)
+
+                        self._flush_points(pending)
+
+                        wait_all(lo_ready, rf_ready, src_ready, sa_ready)
+
+                        i_mul_read = q_mult.submit(sweep.mult_read, 'Мультиметр', mult, 'MEAS:CURR:DC? 1A,DEF')
+                        pow_read = q_sa.submit(
+                            sweep.marker_read, 'Анализатор', sa, ':CALCulate:MARKer:Y?', trigger=True)
+                        wait_all(i_mul_read, pow_read)
+                        pow_read = pow_read.result()
+
+                    pending.append((point_index, self._raw_point(
+                        sweep, freq_lo, freq_lo_label, freq_rf, freq_rf_delta, loss, i_mul_read.result(), pow_read
+                    ), sweep.timer.finish_point()))
+
+                    # time.sleep(120)
+
+                if cancelled:
+                    break
+
+                if sweep.trace_mode:
+                    self._fill_trace_levels(sweep, pending, q_sa.submit(self._fetch_trace, sweep, pending).result())
+                    self._flush_points(pending)
+
+            # a cancelled trace row has no levels yet, its points are dropped
+            if not (cancelled and sweep.trace_mode):
+                self._flush_points(pending)
+
+        # the queues are drained and stopped here, the reset can't interleave with a queued command
+        if cancelled:
+            self._cancel_sweep(sweep)
+            raise RuntimeError('measurement cancelled')
+
+        self._finish_sweep(sweep)
+        return self._measure_current(token, secondary)
+
+    def _start_sweep(self, secondary, done=frozenset()):
+        sweep = SimpleNamespace()
+
+        sweep.gen_lo = gen_lo = self._instruments['P LO']
+        sweep.gen_rf = gen_rf = self._instruments['P RF']
+        sweep.src = src = self._instruments['Источник']
+        sweep.mult = self._instruments['Мультиметр']
+        sweep.sa = sa = self._instruments['Анализатор']
+
+        sweep.src_u = src_u = secondary['Usrc']
         src_i = 200   # mA
         src_u_d = secondary['UsrcD']
         src_i_d = 20   # mA
 
-        u_start = secondary['Umin']
-        u_end = secondary['Umax']
-        u_step = secondary['Udelta']
-
         freq_lo_start = secondary['Flo_min']
         freq_lo_end = secondary['Flo_max']
         freq_lo_step = secondary['Flo_delta']
-        freq_lo_x2 = secondary['is_Flo_x2']
-        d = secondary['D']
+        sweep.freq_lo_x2 = freq_lo_x2 = secondary['is_Flo_x2']
+        sweep.d = d = secondary['D']
 
-        pow_lo = secondary['Plo']
-        pow_rf = secondary['Prf']
+        sweep.pow_lo = pow_lo = secondary['Plo']
+        sweep.pow_rf = pow_rf = secondary['Prf']
 
-        p_loss = secondary['loss']
         ref_level = secondary['ref_level']
         scale_y = secondary['scale_y']
-
-        freq_lo_values = [round(x, 3) for x in np.arange(start=freq_lo_start, stop=freq_lo_end + 0.002, step=freq_lo_step)]
-        freq_rf_deltas_and_losses = [[k / 1_000, v] for k, v in self._deltas.items()]
-        u_values = [round(x, 3) for x in np.arange(start=u_start, stop=u_end + 0.002, step=u_step)]
+        sweep.trace_mode = trace_mode = secondary['is_trace_mode']
+
+        sweep.freq_lo_start = freq_lo_start
+        sweep.freq_lo_values = freq_lo_values = \
+            [round(x, 3) for x in np.arange(start=freq_lo_start, stop=freq_lo_end + 0.002, step=freq_lo_step)]
+        sweep.freq_rf_deltas_and_losses = freq_rf_deltas_and_losses = \
+            [[k / 1_000, v] for k, v in self._deltas.items()]
+
+        # the whole grid is known here, the result stores every point at its grid index
+        self.result.reserve(len(freq_lo_values) * len(freq_rf_deltas_and_losses), len(freq_rf_deltas_and_losses))
+
+        # grid indices measured by a previous run of a resumed sweep, and the LO rows with anything left
+        sweep.done = done
+        sweep.lo_rows = {
+            i // len(freq_rf_deltas_and_losses)
+            for i in range(len(freq_lo_values) * len(freq_rf_deltas_and_losses)) if i not in done
+        }
 
         src.send(f'APPLY p6v,{src_u}V,{src_i}mA')
         src.send(f'APPLY p25v,{src_u_d}V,{src_i_d}mA')
 
         sa.send(':CAL:AUTO OFF')
+        # single sweeps: a read after a retune must come from a sweep started after it
+        sa.send(':INIT:CONT OFF')
         sa.send(':SENS:FREQ:SPAN 1MHz')
         sa.send(f'DISP:WIND:TRAC:Y:RLEV {ref_level}')
         sa.send(f'DISP:WIND:TRAC:Y:PDIV {scale_y}')
@@ -324,117 +915,146 @@ class InstrumentController(QObject):
         gen_rf.send(f':FREQ:MULT {gen_f_mult}')
         gen_lo.send(f':FREQ:MULT {gen_f_mult}')
 
+        if trace_mode:
+            # all IF tones fit into one span, the analyzer holds the max of every RF step
+            # and the whole LO row is read out with a single trace fetch
+            sweep.tones = tones = np.array([delta for delta, _ in freq_rf_deltas_and_losses]) / gen_f_mult
+            sweep.trace_window = trace_window = self.rigParams['trace_window']
+            sweep.trace_start = max(tones.min() - 2 * trace_window, 0)
+            sweep.trace_stop = tones.max() + 2 * trace_window
+
+            sa.send(f'DISP:WIND:TRAC:X:OFFS 0MHz')
+            sa.send(f':SENS:FREQ:STAR {sweep.trace_start}GHz')
+            sa.send(f':SENS:FREQ:STOP {sweep.trace_stop}GHz')
+            sa.send(f':SENS:SWE:POIN {self.rigParams["trace_points"]}')
+            sa.send(':FORM:TRAC:DATA ASC')
+
+        sweep.mocked_raw_data = None
         if mock_enabled:
             with open('./mock_data/-5db.txt', mode='rt', encoding='utf-8') as f:
-                index = 0
-                mocked_raw_data = ast.literal_eval(''.join(f.readlines()))
-
-        res = []
-        for freq_lo in freq_lo_values:
-
-            freq_lo_label = float(freq_lo)
-            if freq_lo_x2:
-                freq_lo *= 2
-                freq_lo_label *= 2
-
-            gen_lo.send(f'SOUR:FREQ {freq_lo}GHz')
-
-            for freq_rf_delta, loss in freq_rf_deltas_and_losses:
-
-                if token.cancelled:
-                    gen_lo.send(f'OUTP:STAT OFF')
-                    gen_rf.send(f'OUTP:STAT OFF')
-
-                    if not mock_enabled:
-                        time.sleep(0.5)
-
-                    src.send('OUTPut OFF')
-
-                    gen_rf.send(f'SOUR:POW {pow_rf}dbm')
-                    gen_lo.send(f'SOUR:POW {pow_lo}dbm')
-
-                    gen_rf.send(f'SOUR:FREQ {freq_lo_start + freq_rf_deltas_and_losses[0][0]}GHz')
-                    gen_lo.send(f'SOUR:FREQ {freq_lo_start}GHz')
-                    raise RuntimeError('measurement cancelled')
-
-                delta_lo = round(self._calibrated_pows_lo.get(freq_lo, 0), 2)
-                gen_lo.send(f'SOUR:POW {pow_lo + delta_lo}dbm')
-                delta_rf = round(self._calibrated_pows_rf.get(freq_lo, dict()).get(freq_rf_delta, 0), 2)
-                gen_rf.send(f'SOUR:POW {pow_rf + delta_rf}dbm')
-
-                freq_rf = (freq_lo if not freq_lo_x2 else (freq_lo / 2)) + freq_rf_delta
-                gen_rf.send(f'SOUR:FREQ {freq_rf}GHz')
-
-                src.send('OUTPut ON')
+                sweep.mock_index = 0
+                sweep.mocked_raw_data = ast.literal_eval(''.join(f.readlines()))
+
+        sweep.lo_table, sweep.rf_table = \
+            self._generator_tables(freq_lo_values, freq_rf_deltas_and_losses, pow_lo, pow_rf, freq_lo_x2)
+
+        sweep.lo_list = sweep.rf_list = None
+        if self.rigParams['gen_list'] and sweep.lo_rows:
+            # the lists hold only the points left to measure, one step per visited row/point
+            sweep.lo_list = self._start_generator_list(
+                gen_lo, [row for i, row in enumerate(sweep.lo_table) if i in sweep.lo_rows])
+            sweep.rf_list = self._start_generator_list(
+                gen_rf, [row for i, row in enumerate(sweep.rf_table) if i not in done])
+
+        # every instrument call of the point loop goes through a timed wrapper
+        sweep.timer = timer = PhaseTimer()
+        sweep.lo_send = timer.wrap('gen_retune', gen_lo.send)
+        sweep.rf_send = timer.wrap('gen_retune', gen_rf.send)
+        sweep.lo_step = timer.wrap('gen_retune', sweep.lo_list.step) if sweep.lo_list else None
+        sweep.rf_step = timer.wrap('gen_retune', sweep.rf_list.step) if sweep.rf_list else None
+        sweep.src_send = timer.wrap('psu_enable', src.send)
+        sweep.sa_send = timer.wrap('sa_retune', sa.send)
+        sweep.settle = timer.wrap('settle', self._settle.wait)
+        sweep.mult_read = timer.wrap('mult_read', self._settle.read_stable)
+        sweep.marker_read = timer.wrap('marker_read', self._settle.read_stable)
+        sweep.trace_sweep = timer.wrap('marker_read', self._trace_sweep)
+
+        return sweep
+
+    def _raw_point(self, sweep, freq_lo, freq_lo_label, freq_rf, freq_rf_delta, loss, i_mul_read, pow_read):
+        raw_point = {
+            'f_lo': freq_lo,
+            'f_lo_label': freq_lo_label,
+            'f_rf': freq_rf,
+            'p_lo': sweep.pow_lo,
+            'p_rf': sweep.pow_rf,
+            'fpch': freq_rf_delta,
+            'u_mul': sweep.src_u,
+            'i_mul': i_mul_read,
+            'pow_read': pow_read,
+            'loss': loss,
+        }
 
-                gen_lo.send(f'OUTP:STAT ON')
-                gen_rf.send(f'OUTP:STAT ON')
+        if mock_enabled:
+            raw_point = sweep.mocked_raw_data[sweep.mock_index]
+            raw_point['loss'] = loss
+            raw_point['fpch'] = freq_rf_delta
+            raw_point['f_lo_label'] = freq_lo_label
+            sweep.mock_index += 1
+
+        return raw_point
+
+    def _trace_sweep(self, sa):
+        sa.send(':INIT:IMM')
+        return self._settle.wait('Анализатор', sa, fixed=0.5)
+
+    def _fetch_trace(self, sweep, points):
+        # one fetch per LO row, its time is shared between the points of the row
+        start = time.perf_counter()
+        answer = sweep.sa.query(':TRAC:DATA? TRACE1')
+        sweep.timer.spread('marker_read', time.perf_counter() - start, [timing for _, _, timing in points])
+        return answer
+
+    def _fill_trace_levels(self, sweep, points, answer):
+        levels = tone_levels(parse_trace(answer), sweep.trace_start, sweep.trace_stop, sweep.tones, sweep.trace_window)
+        if mock_enabled:
+            return
+        for index, point, _ in points:
+            point['pow_read'] = float(levels[index % len(levels)])
 
-                time.sleep(0.01)
-                if not mock_enabled:
-                    time.sleep(0.5)
+    def _reset_generators(self, sweep):
+        gen_lo, gen_rf = sweep.gen_lo, sweep.gen_rf
 
-                i_mul_read = float(mult.query('MEAS:CURR:DC? 1A,DEF'))
+        gen_lo.send(f'OUTP:STAT OFF')
+        gen_rf.send(f'OUTP:STAT OFF')
 
-                center_freq = freq_rf_delta
-                offset = 0 if not d else freq_rf_delta * 1_000 / 2
-                sa.send(f'DISP:WIND:TRAC:X:OFFS {offset}MHz')
-                sa.send(':CALC:MARK1:MODE POS')
-                sa.send(f':SENSe:FREQuency:CENTer {center_freq}GHz')
-                sa.send(f':CALCulate:MARKer1:X:CENTer {center_freq}GHz')
+        if not mock_enabled:
+            time.sleep(0.5)
 
-                if not mock_enabled:
-                    time.sleep(0.5)
+        sweep.src.send('OUTPut OFF')
 
-                pow_read = float(sa.query(':CALCulate:MARKer:Y?'))
-
-                raw_point = {
-                    'f_lo': freq_lo,
-                    'f_lo_label': freq_lo_label,
-                    'f_rf': freq_rf,
-                    'p_lo': pow_lo,
-                    'p_rf': pow_rf,
-                    'fpch': freq_rf_delta,
-                    'u_mul': src_u,
-                    'i_mul': i_mul_read,
-                    'pow_read': pow_read,
-                    'loss': loss,
-                }
+        self._stop_generator_lists(sweep.lo_list, sweep.rf_list)
 
-                if mock_enabled:
-                    raw_point = mocked_raw_data[index]
-                    raw_point['loss'] = loss
-                    raw_point['fpch'] = freq_rf_delta
-                    raw_point['f_lo_label'] = freq_lo_label
-                    index += 1
+        gen_rf.send(f'SOUR:POW {sweep.pow_rf}dbm')
+        gen_lo.send(f'SOUR:POW {sweep.pow_lo}dbm')
 
-                print(raw_point)
+        gen_rf.send(f'SOUR:FREQ {sweep.freq_lo_start + sweep.freq_rf_deltas_and_losses[0][0]}GHz')
+        gen_lo.send(f'SOUR:FREQ {sweep.freq_lo_start}GHz')
 
-                res.append(raw_point)
-                self._add_measure_point(raw_point)
+    def _cancel_sweep(self, sweep):
+        self._reset_generators(sweep)
 
-                # time.sleep(120)
+        if sweep.trace_mode:
+            sweep.sa.send(':TRAC1:MODE WRIT')
+        sweep.sa.send(':INIT:CONT ON')
 
+    def _finish_sweep(self, sweep):
         if not mock_enabled:
             with open('out.txt', mode='wt', encoding='utf-8') as f:
-                f.write(str(res))
+                f.write(str(self.result.raw_points()))
 
-        gen_lo.send(f'OUTP:STAT OFF')
-        gen_rf.send(f'OUTP:STAT OFF')
+        self._reset_generators(sweep)
 
-        if not mock_enabled:
-            time.sleep(0.5)
+        sa = sweep.sa
+        sa.send(f'DISP:WIND:TRAC:X:OFFS 0')
+        sa.send(':CAL:AUTO ON')
+        sa.send(':INIT:CONT ON')
 
-        src.send('OUTPut OFF')
+        if sweep.trace_mode:
+            sa.send(':TRAC1:MODE WRIT')
+            sa.send(':SENS:FREQ:SPAN 1MHz')
 
-        gen_rf.send(f'SOUR:POW {pow_rf}dbm')
-        gen_lo.send(f'SOUR:POW {pow_lo}dbm')
+    def _measure_current(self, token, secondary):
+        src = self._instruments['Источник']
+        mult = self._instruments['Мультиметр']
 
-        gen_rf.send(f'SOUR:FREQ {freq_lo_start + freq_rf_deltas_and_losses[0][0]}GHz')
-        gen_lo.send(f'SOUR:FREQ {freq_lo_start}GHz')
+        src_i = 200   # mA
 
-        sa.send(f'DISP:WIND:TRAC:X:OFFS 0')
-        sa.send(':CAL:AUTO ON')
+        u_start = secondary['Umin']
+        u_end = secondary['Umax']
+        u_step = secondary['Udelta']
+
+        u_values = [round(x, 3) for x in np.arange(start=u_start, stop=u_end + 0.002, step=u_step)]
 
         # measure current
         # temporary hacky implementation
@@ -452,12 +1072,10 @@ class InstrumentController(QObject):
             src.send(f'APPLY p6v,{u}V,{src_i}mA')
             src.send('OUTPut ON')
 
-            time.sleep(0.1)
-            if not mock_enabled:
-                time.sleep(0.5)
+            self._settle.wait('Источник', src, fixed=0.6)
 
             # u_mul_read = float(mult.query('MEAS:VOLT?'))
-            i_mul_read = float(mult.query('MEAS:CURR:DC? 1A,DEF'))
+            i_mul_read = self._settle.read_stable('Мультиметр', mult, 'MEAS:CURR:DC? 1A,DEF')
 
             raw_point = {
                 'u_mul': u,
@@ -470,22 +1088,111 @@ class InstrumentController(QObject):
                 raw_point['i_mul'] *= 1_000
                 index += 1
 
-            print(raw_point)
+            log.debug('measured current: %s', raw_point)
 
             i_res.append(raw_point)
 
         if not mock_enabled:
             time.sleep(0.5)
         src.send('OUTPut OFF')
-        return res, i_res
+        return i_res
+
+    def _generator_tables(self, freq_lo_values, freq_rf_deltas_and_losses, pow_lo, pow_rf, freq_lo_x2):
+        # the calibration is evaluated once for the whole grid, points between the calibrated ones are interpolated
+        freq_lo_base = np.array(freq_lo_values, dtype=float)
+        freq_lo_out = freq_lo_base * 2 if freq_lo_x2 else freq_lo_base
+        freq_rf_deltas = [freq_rf_delta for freq_rf_delta, _ in freq_rf_deltas_and_losses]
+
+        delta_lo = np.round(self._calibration.lo(freq_lo_out), 2).tolist()
+        # RF is calibrated against the LO frequency before the doubler
+        delta_rf = np.round(self._calibration.rf(freq_lo_base, freq_rf_deltas), 2).tolist()
 
-    def _add_measure_point(self, data):
-        print('measured point:', data)
-        self.result.add_point(data)
+        lo_table = []
+        rf_table = []
+        for freq_lo, freq_lo_gen, row_lo, row_rf in zip(freq_lo_base.tolist(), freq_lo_out.tolist(), delta_lo, delta_rf):
+            lo_table.append([freq_lo_gen, pow_lo + row_lo])
+
+            for freq_rf_delta, delta in zip(freq_rf_deltas, row_rf):
+                rf_table.append([freq_lo + freq_rf_delta, pow_rf + delta])
+        return lo_table, rf_table
+
+    def _calibration_grid(self, secondary):
+        """LO frequencies and IF offsets to calibrate at, coarser than the sweep grid with cal_lo_step / cal_if_every."""
+        freq_lo_start = secondary['Flo_min']
+        freq_lo_end = secondary['Flo_max']
+        freq_lo_step = self.rigParams['cal_lo_step'] or secondary['Flo_delta']
+
+        # plain floats, np.float64 keys don't read back from the .ini files
+        freq_lo_values = [float(round(x, 3)) for x in
+                          np.arange(start=freq_lo_start, stop=freq_lo_end + 0.002, step=freq_lo_step)]
+        # the edges are always calibrated, the model holds the edge value outside
+        if freq_lo_values[-1] < round(freq_lo_end, 3):
+            freq_lo_values.append(float(round(freq_lo_end, 3)))
+
+        deltas = sorted(self._deltas)
+        picked = deltas[::max(1, int(self.rigParams['cal_if_every']))]
+        if picked[-1] != deltas[-1]:
+            picked.append(deltas[-1])
+        return freq_lo_values, [[k / 1_000, self._deltas[k]] for k in picked]
+
+    def _calibration_condition(self, kind, secondary):
+        # what the loss depends on besides frequency, points measured under another condition are not reused
+        if kind == 'lo':
+            return {'Plo': secondary['Plo'], 'is_Flo_x2': secondary['is_Flo_x2']}
+        return {'Prf': secondary['Prf']}
+
+    def _stored_calibration(self, kind, secondary):
+        if not self.rigParams['cal_reuse']:
+            return {}
+        return self._cal_store.points(kind, self._calibration_condition(kind, secondary))
+
+    def _store_calibration(self, kind, secondary, result, stored):
+        if kind == 'lo':
+            points = {point_key(freq): loss for freq, loss in result.items()}
+        else:
+            points = {point_key(freq_lo, freq_rf_delta): loss
+                      for freq_lo, row in result.items() for freq_rf_delta, loss in row.items()}
+        measured = {k: v for k, v in points.items() if k not in stored}
+        log.info('calibration %s: %s points measured, %s reused', kind, len(measured), len(points) - len(measured))
+        self._cal_store.update(kind, self._calibration_condition(kind, secondary), measured)
+
+    def _calibration_table_lo(self):
+        return dict(zip(self._calibration.lo_freqs.tolist(), self._calibration.lo_losses.tolist()))
+
+    def _calibration_table_rf(self):
+        return {
+            freq_lo: dict(zip(deltas.tolist(), losses.tolist()))
+            for freq_lo, (deltas, losses) in zip(self._calibration.rf_freqs.tolist(), self._calibration.rf_rows)
+        }
+
+    def _start_generator_list(self, gen, table):
+        if not GeneratorList.supported(gen):
+            log.warning('%s has no list mode, retuning point by point', gen.model)
+            return None
+
+        gen_list = GeneratorList(gen)
+        gen_list.upload(table)
+        gen_list.start()
+        return gen_list
+
+    def _stop_generator_lists(self, *gen_lists):
+        for gen_list in gen_lists:
+            if gen_list is not None:
+                gen_list.stop()
+
+    def _flush_points(self, points):
+        for index, point, timing in points:
+            self._add_measure_point(point, timing, index)
+        points.clear()
+
+    def _add_measure_point(self, data, timing=None, index=None):
+        log.debug('measured point: %s', data)
+        self.result.add_point(data, timing, index)
         self.pointReady.emit()
 
     def saveConfigs(self):
         pprint_to_file('params.ini', self.secondaryParams)
+        pprint_to_file('rig.ini', self.rigParams)
 
     @pyqtSlot(dict)
     def on_secondary_changed(self, params):
@@ -494,3 +1201,7 @@ class InstrumentController(QObject):
     @property
     def status(self):
         return [i.status for i in self._instruments.values()]
+
+
+def _in_regions(freq_lo, regions):
+    return any(low - 1e-6 <= freq_lo <= high + 1e-6 for low, high in regions)
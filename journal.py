@@ -0,0 +1,113 @@
+import datetime
+import glob
+import json
+import os
+import time
+
+import applog
+
+log = applog.get_logger('journal')
+
+
+class Journal:
+    """
+    Append-only JSON lines file written while the sweep runs.
+
+    The first line is the run header, then one line per point: grid index, raw values and phase timing,
+    the current-vs-voltage table goes last. Every entry is flushed to the OS right away,
+    fsync is batched by entry count and time, so a crash of the program loses nothing
+    and a power loss loses at most one batch.
+    """
+
+    def __init__(self, path, sync_every=20, sync_interval=2.0):
+        self.path = path
+        self._sync_every = sync_every
+        self._sync_interval = sync_interval
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, mode='at', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def new_path(directory, device):
+        return os.path.join(directory, f'{device}-{datetime.datetime.now().isoformat().replace(":", ".")}.jsonl')
+
+    def write_header(self, header):
+        self._write({'header': header})
+        self.sync()
+
+    def append(self, index, raw, timing=None):
+        self._write({'i': index, 'raw': raw, 't': timing})
+        self._unsynced += 1
+        if self._unsynced >= self._sync_every or time.monotonic() - self._synced_at >= self._sync_interval:
+            self.sync()
+
+    def write_current(self, data):
+        self._write({'current': data})
+        self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=float) + '\n')
+        self._file.flush()
+
+
+def read_journal(path):
+    """Returns (header, points, current), points are (index, raw, timing) in write order."""
+    header = None
+    points = []
+    current = None
+    with open(path, mode='rt', encoding='utf-8') as f:
+        for number, line in enumerate(f, start=1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line can be cut short by a crash
+                log.warning('%s: skipping broken line %s', path, number)
+                continue
+            if 'header' in entry:
+                header = entry['header']
+            elif 'current' in entry:
+                current = entry['current']
+            else:
+                points.append((entry['i'], entry['raw'], entry['t']))
+    return header, points, current
+
+
+def read_header(path):
+    with open(path, mode='rt', encoding='utf-8') as f:
+        try:
+            return json.loads(f.readline()).get('header')
+        except ValueError:
+            return None
+
+
+def find_journal(directory, header):
+    """Newest journal in `directory` whose header has the same values for every key of `header`."""
+    # compare in JSON form, tuples and int dict keys don't survive the round trip
+    header = json.loads(json.dumps(header, default=float))
+    paths = sorted(glob.glob(os.path.join(directory, f'{glob.escape(header["device"])}-*.jsonl')),
+                   key=os.path.getmtime, reverse=True)
+    for path in paths:
+        found = read_header(path)
+        if found and all(found.get(k) == v for k, v in header.items()):
+            return path
+    return None
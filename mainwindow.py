@@ -2,19 +2,45 @@ import datetime
 import os
 import time
 
-from subprocess import Popen
-
 from PyQt5.QtGui import QGuiApplication
 from PyQt5 import uic
 from PyQt5.QtWidgets import QMainWindow
-from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QObject, QRunnable, QThreadPool
+
+import applog
 
 from formlayout.formlayout import fedit
+from coalescer import UpdateCoalescer
 from instrumentcontroller import InstrumentController
 from connectionwidget import ConnectionWidget
 from measurewidget import MeasureWidgetWithSecondaryParameters
 from primaryplotwidget import PrimaryPlotWidget
 from resulttablewidget import ResultTableWidget
+from xlsxexport import reveal, write_workbooks
+
+log = applog.get_logger('gui')
+
+
+class ExportSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+
+class ExportTask(QRunnable):
+
+    def __init__(self, workbooks):
+        super().__init__()
+        self.workbooks = workbooks
+        self.signals = ExportSignals()
+
+    def run(self):
+        try:
+            write_workbooks(self.workbooks, self.signals.progress.emit)
+        except Exception as ex:
+            self.signals.failed.emit(str(ex))
+            return
+        self.signals.finished.emit(self.workbooks[0][0])
 
 
 class MainWindow(QMainWindow):
@@ -47,6 +73,12 @@ class MainWindow(QMainWindow):
         self._ui.tabWidget.insertTab(0, self._plotWidget, 'Прогресс измерения')
         self._ui.tabWidget.setCurrentIndex(0)
 
+        self._threads = QThreadPool()
+        self._exportTask = None
+
+        # points arrive from the measure thread faster than the window can redraw
+        self._updates = UpdateCoalescer(self._instrumentController.rigParams['gui_max_fps'], parent=self)
+
         self._init()
 
     def _init(self):
@@ -58,7 +90,8 @@ class MainWindow(QMainWindow):
         self._measureWidget.measureStarted.connect(self.on_measureStarted)
         self._measureWidget.measureComplete.connect(self.on_measureComplete)
 
-        self._instrumentController.pointReady.connect(self.on_point_ready)
+        self._instrumentController.pointReady.connect(self._updates.notify)
+        self._updates.updated.connect(self.on_point_ready)
 
         self._measureWidget.updateWidgets(self._instrumentController.secondaryParams)
         self._measureWidget.on_params_changed(1)
@@ -78,8 +111,7 @@ class MainWindow(QMainWindow):
         file_name = f'./{path}/{device}-{datetime.datetime.now().isoformat().replace(":", ".")}.png'
         pixmap.save(file_name)
 
-        full_path = os.path.abspath(file_name)
-        Popen(f'explorer /select,"{full_path}"')
+        reveal(file_name)
 
     @pyqtSlot()
     def on_instrumens_connected(self):
@@ -88,6 +120,8 @@ class MainWindow(QMainWindow):
     @pyqtSlot()
     def on_measureComplete(self):
         print('meas complete')
+        self._updates.flush()
+        log.info('gui updates: %s points in %s redraws', self._updates.notified, self._updates.emitted)
         self._instrumentController.result.process()
         self._plotWidget.plot()
         self._instrumentController.result.save_adjustment_template()
@@ -95,6 +129,7 @@ class MainWindow(QMainWindow):
 
     @pyqtSlot()
     def on_measureStarted(self):
+        self._updates.reset_stats()
         self._plotWidget.clear()
 
     @pyqtSlot()
@@ -129,10 +164,35 @@ class MainWindow(QMainWindow):
         self._measureWidget.cancel()
         while self._measureWidget._threads.activeThreadCount() > 0:
             time.sleep(0.1)
+        self._threads.waitForDone()
 
     @pyqtSlot()
     def on_btnExcel_clicked(self):
-        self._instrumentController.result.export_excel()
+        # the frames are taken here, the workbooks are written by the pool while the window stays responsive
+        self._exportTask = ExportTask(self._instrumentController.result.excel_workbooks())
+        self._exportTask.signals.progress.connect(self.on_export_progress)
+        self._exportTask.signals.finished.connect(self.on_export_finished)
+        self._exportTask.signals.failed.connect(self.on_export_failed)
+
+        self._ui.btnExcel.setEnabled(False)
+        self._ui.statusbar.showMessage('Экспорт в Excel...')
+        self._threads.start(self._exportTask)
+
+    @pyqtSlot(int, int)
+    def on_export_progress(self, done, total):
+        self._ui.statusbar.showMessage(f'Экспорт в Excel: {done} из {total} строк')
+
+    @pyqtSlot(str)
+    def on_export_finished(self, path):
+        self._ui.btnExcel.setEnabled(True)
+        self._ui.statusbar.showMessage(f'Сохранено: {path}', 5000)
+        reveal(path)
+
+    @pyqtSlot(str)
+    def on_export_failed(self, error):
+        print(f'error exporting to Excel: {error}')
+        self._ui.btnExcel.setEnabled(True)
+        self._ui.statusbar.showMessage(f'Ошибка экспорта: {error}')
 
     @pyqtSlot()
     def on_btnScreenShot_clicked(self):
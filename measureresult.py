@@ -1,15 +1,23 @@
+import argparse
 import datetime
-import os.path
-import openpyxl
 import random
+import sys
 
-from collections import defaultdict
-from subprocess import Popen
+from collections.abc import Sequence
 from textwrap import dedent
 
+import numpy as np
 import pandas as pd
 
+import applog
+from adjustment import AdjustmentIndex, KEYS as ADJUST_KEYS
 from forgot_again.file import load_ast_if_exists, pprint_to_file
+from journal import read_journal
+from phasetimer import COLUMNS as TIMING_COLUMNS, summarize
+from spectable import load_spec_table
+from xlsxexport import reveal, write_workbooks
+
+log = applog.get_logger('result')
 
 KHz = 1_000
 MHz = 1_000_000
@@ -17,20 +25,64 @@ GHz = 1_000_000_000
 mA = 1_000
 mV = 1_000
 
+# one float column per raw point value, 'fpch' and 'k_loss' go last and side by side,
+# so a plot curve is a plain slice of the store
+COLUMNS = ('f_lo', 'f_lo_label', 'f_rf', 'p_lo', 'p_rf', 'u_mul', 'i_mul', 'pow_read', 'loss', 'fpch', 'k_loss')
+RAW_COLUMNS = COLUMNS[:-1]
+
+_col = {name: i for i, name in enumerate(COLUMNS)}
+F_LO_LABEL = _col['f_lo_label']
+FPCH = _col['fpch']
+K_LOSS = _col['k_loss']
+ADJUST_COLUMNS = [_col[k] for k in ADJUST_KEYS]
+
+
+class ProcessedPoints(Sequence):
+    """Read-only view of the measured points as report dicts, built on access."""
+
+    def __init__(self, result):
+        self._result = result
+
+    def __len__(self):
+        return self._result.count
+
+    def __getitem__(self, item):
+        indices = self._result.indices()
+        if isinstance(item, slice):
+            return [self._result.processed_point(i) for i in indices[item]]
+        return self._result.processed_point(indices[item])
+
+    def __iter__(self):
+        for index in self._result.indices():
+            yield self._result.processed_point(index)
+
 
 class MeasureResult:
     def __init__(self):
         self._primary_params = None
         self._secondaryParams = None
-        self._raw = list()
-        self._report = dict()
-        self._processed = list()
+        self._journal = None
+        self._last = None
         self.ready = False
 
-        self.data = defaultdict(list)
+        # points live at their grid index, a grid row is one LO frequency
+        self._row_size = None
+        self._values = np.full((0, len(COLUMNS)), np.nan)
+        self._timings = np.full((0, len(TIMING_COLUMNS)), np.nan)
+        self._filled = np.zeros(0, dtype=bool)
+        self.count = 0
+
+        # grid indices in the order they were added, and a counter bumped whenever stored points
+        # change in place, so a plot can take only the new points or knows it has to start over
+        self._added = []
+        self.generation = 0
+
+        self._processed = ProcessedPoints(self)
         self.data_i = dict()
 
-        self.adjustment = load_ast_if_exists('adjust.ini', default=None)
+        self.adjust_nearest = False
+        self.adjust_tolerance = None
+        self.adjustment = self._load_adjustment('adjust.ini')
         self._table_header = list()
         self._table_data = list()
 
@@ -41,33 +93,109 @@ class MeasureResult:
         self.ready = True
         self._prepare_table_data()
 
-    def _process_point(self, data):
-        # region calc
-        p_lo = data['p_lo']
-        f_lo = data['f_lo']
-        f_lo_label = data['f_lo_label']
+    def reserve(self, size, row_size):
+        if row_size != self._row_size:
+            if self.count:
+                log.warning('grid row size changed from %s to %s, dropping %s points',
+                            self._row_size, row_size, self.count)
+            self._row_size = row_size
+            self._allocate(0)
+        self._grow(size)
+
+    def _allocate(self, capacity):
+        self._values = np.full((capacity, len(COLUMNS)), np.nan)
+        self._timings = np.full((capacity, len(TIMING_COLUMNS)), np.nan)
+        self._filled = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        self._last = None
+        self._added = []
+        self.generation += 1
+
+    def _grow(self, size):
+        capacity = len(self._filled)
+        if size <= capacity:
+            return
+        size = max(size, capacity * 2)
+        if self._row_size:
+            size = -(-size // self._row_size) * self._row_size
+
+        values, timings, filled = self._values, self._timings, self._filled
+        self._values = np.full((size, len(COLUMNS)), np.nan)
+        self._timings = np.full((size, len(TIMING_COLUMNS)), np.nan)
+        self._filled = np.zeros(size, dtype=bool)
+        self._values[:capacity] = values
+        self._timings[:capacity] = timings
+        self._filled[:capacity] = filled
+
+    @property
+    def adjustment(self):
+        return self._adjustment
 
-        p_rf = data['p_rf']
-        f_rf = data['f_rf']
-        f_pch = data['fpch']
+    @adjustment.setter
+    def adjustment(self, value):
+        if not isinstance(value, AdjustmentIndex):
+            value = AdjustmentIndex(value, nearest=self.adjust_nearest, tolerance=self.adjust_tolerance)
+        self._adjustment = value
 
-        u_mul = data['u_mul']
-        i_mul = data['i_mul']
+    def _load_adjustment(self, path):
+        return AdjustmentIndex.load(path, nearest=self.adjust_nearest, tolerance=self.adjust_tolerance)
 
-        p_pch = data['pow_read']
+    def _process_point(self, index):
+        self._process(np.array([index]))
 
-        p_loss = data['loss']
+    def _process(self, indices):
+        # region calc
+        values = self._values
+        p_rf = values[indices, _col['p_rf']]
+        p_pch = values[indices, _col['pow_read']]
+        p_loss = values[indices, _col['loss']]
         k_loss = p_pch - p_rf + p_loss
         # endregion
 
-        if self.adjustment is not None:
-            try:
-                point = self.adjustment[len(self._processed)]
-                k_loss += point['k_loss']
-            except LookupError:
-                pass
-
-        self._report = {
+        k_loss += self._adjustment.lookup_many(values[np.ix_(indices, ADJUST_COLUMNS)])
+
+        values[indices, K_LOSS] = k_loss
+
+    def reprocess(self, adjustment=None, loss=None):
+        """
+        Recomputes k_loss of every stored point in one pass.
+
+        `adjustment` is an adjust_*.ini/.npy path or an already loaded table, `loss` replaces the stored
+        per-point loss: a scalar, an array in grid order or {fpch: loss} like deltas.ini.
+        """
+        if adjustment is not None:
+            self.adjustment = self._load_adjustment(adjustment) if isinstance(adjustment, str) else adjustment
+
+        indices = self.indices()
+        if loss is not None:
+            if isinstance(loss, dict):
+                # deltas.ini keys are MHz, fpch is GHz
+                by_fpch = {round(k / 1_000, 6): v for k, v in loss.items()}
+                fpch = self._values[indices, FPCH].tolist()
+                stored = self._values[indices, _col['loss']].tolist()
+                loss = [by_fpch.get(round(f, 6), old) for f, old in zip(fpch, stored)]
+            self._values[indices, _col['loss']] = loss
+        self._process(indices)
+        self.generation += 1
+
+    def processed_frame(self):
+        """Every reported column of the measured points, derived over the whole store at once."""
+        values = self._values[self._filled]
+        return pd.DataFrame({
+            'p_lo': values[:, _col['p_lo']],
+            'f_lo': values[:, _col['f_lo']],
+            'p_rf': values[:, _col['p_rf']],
+            'f_rf': values[:, _col['f_rf']],
+            'f_pch': values[:, FPCH],
+            'u_mul': np.round(values[:, _col['u_mul']], 1),
+            'i_mul': np.round(values[:, _col['i_mul']] * mA, 2),
+            'p_pch': values[:, _col['pow_read']],
+            'k_loss': np.round(values[:, K_LOSS], 2),
+        })
+
+    def processed_point(self, index):
+        f_lo, _, f_rf, p_lo, p_rf, u_mul, i_mul, p_pch, _, f_pch, k_loss = self._values[index].tolist()
+        return {
             'p_lo': p_lo,
             'f_lo': f_lo,
             'p_rf': p_rf,
@@ -79,18 +207,63 @@ class MeasureResult:
             'k_loss': round(k_loss, 2),
         }
 
-        self.data[f_lo_label].append([f_pch, k_loss])
-        self._processed.append({**self._report})
+    def indices(self):
+        return np.flatnonzero(self._filled)
+
+    @property
+    def data(self):
+        """{f_lo_label: (n, 2) array of [f_pch, k_loss]}, slices of the store while the rows fill in order."""
+        values, filled = self._values, self._filled
+        if not self._row_size:
+            labels = values[:, F_LO_LABEL]
+            return {
+                label: values[filled & (labels == label), FPCH:K_LOSS + 1]
+                for label in dict.fromkeys(labels[filled].tolist())
+            }
+
+        counts = filled.reshape(-1, self._row_size).sum(axis=1)
+        return dict(self.row_curve(row) for row in np.flatnonzero(counts))
+
+    @property
+    def row_size(self):
+        return self._row_size
+
+    def row_curve(self, row):
+        """(f_lo_label, (n, 2) array of [f_pch, k_loss]) of grid row `row`, a view while the row fills in order."""
+        values, filled = self._values, self._filled
+        start = row * self._row_size
+        row_filled = filled[start:start + self._row_size]
+        count = int(row_filled.sum())
+        if row_filled[:count].all():
+            curve = values[start:start + count, FPCH:K_LOSS + 1]
+        else:
+            curve = values[start:start + self._row_size][row_filled, FPCH:K_LOSS + 1]
+        label = values[start + np.argmax(row_filled), F_LO_LABEL]
+        return float(label), curve
+
+    def added_since(self, seen):
+        """Grid indices added after the first `seen` ones, and the number added so far."""
+        added = self._added
+        count = len(added)
+        return added[seen:count], count
+
+    def raw_points(self):
+        return [
+            dict(zip(RAW_COLUMNS, self._values[index, :K_LOSS].tolist()))
+            for index in self.indices()
+        ]
 
     def clear(self):
         self._secondaryParams.clear()
-        self._raw.clear()
-        self._report.clear()
-        self._processed.clear()
-
-        self.data.clear()
+        self._filled[:] = False
+        self._values[:] = np.nan
+        self._timings[:] = np.nan
+        self.count = 0
+        self._last = None
+        self._added = []
+        self.generation += 1
 
-        self.adjustment = load_ast_if_exists(self._primary_params.get('adjust', ''), default={})
+        self.adjustment = self._load_adjustment(self._primary_params.get('adjust', ''))
 
         self.ready = False
 
@@ -100,13 +273,51 @@ class MeasureResult:
     def set_primary_params(self, params):
         self._primary_params = dict(**params)
 
-    def add_point(self, data):
-        self._raw.append(data)
-        self._process_point(data)
+    def add_point(self, data, timing=None, index=None):
+        if index is None:
+            index = self.count
+        if self._journal is not None:
+            self._journal.append(index, data, timing)
+
+        self._grow(index + 1)
+        self._values[index, :K_LOSS] = [data[name] for name in RAW_COLUMNS]
+        if timing is not None:
+            self._timings[index] = [timing[name] for name in TIMING_COLUMNS]
+        # the GUI thread reads while the sweep adds points: a point is published only once it is complete
+        self._process_point(index)
+        if not self._filled[index]:
+            self._filled[index] = True
+            self.count += 1
+        self._last = index
+        self._added.append(index)
+
+    def open_journal(self, journal):
+        self._journal = journal
+
+    def close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def load_journal(self, path):
+        header, points, current = read_journal(path)
+
+        self.set_primary_params(header['primary'])
+        self.set_secondary_params(header['secondary'])
+        self.reserve(len(points), len(header['deltas']))
+        self.clear()
+        # clear() empties the secondary params along with the points
+        self.set_secondary_params(header['secondary'])
+
+        for index, raw, timing in points:
+            self.add_point(raw, timing, index)
+        if current is not None:
+            self.process_i(current)
+        return header
 
     def save_adjustment_template(self):
         if not self.adjustment:
-            print('measured, saving template')
+            log.info('measured, saving template')
             self.adjustment = [{
                 'p_lo': p['p_lo'],
                 'f_lo': p['f_lo'],
@@ -115,13 +326,29 @@ class MeasureResult:
                 'k_loss': 0,
             } for p in self._processed]
 
-        pprint_to_file('adjust.ini', self.adjustment)
+        pprint_to_file('adjust.ini', self.adjustment.table())
 
     def process_i(self, data):
-        self.data_i[1] = [list(d.values()) for d in data]
+        if self._journal is not None:
+            self._journal.write_current(data)
+        self.data_i[1] = np.array([list(d.values()) for d in data], dtype=float).reshape(-1, 2)
+
+    @property
+    def measured_indices(self):
+        return set(self.indices().tolist())
+
+    @property
+    def timing_summary(self):
+        return summarize(self._timed())
+
+    def _timed(self):
+        timings = self._timings[self._filled]
+        return timings[~np.isnan(timings[:, -1])]
 
     @property
     def report(self):
+        if self._last is None:
+            return ''
         return dedent("""        Генераторы:
         Pгет, дБм={p_lo}
         Fгет, ГГц={f_lo:0.2f}
@@ -137,17 +364,17 @@ class MeasureResult:
         Pп, дБм={p_pch}
         
         Расчётные параметры:
-        Кп, дБм={k_loss}""".format(**self._report))
+        Кп, дБм={k_loss}""".format(**self.processed_point(self._last)))
 
-    def export_excel(self):
+    def excel_workbooks(self):
+        """The stage 3 and stage 4 workbooks as (path, sheets), taken from the store at the time of the call."""
         device = 'demod'
         path = 'xlsx'
-        if not os.path.isdir(f'{path}'):
-            os.makedirs(f'{path}')
-        file_name_main = f'./{path}/{device}-stage3-{datetime.datetime.now().isoformat().replace(":", ".")}.xlsx'
-        file_name_current = f'./{path}/{device}-stage4-{datetime.datetime.now().isoformat().replace(":", ".")}.xlsx'
-        df = pd.DataFrame(self._processed)
+        stamp = datetime.datetime.now().isoformat().replace(":", ".")
+        file_name_main = f'./{path}/{device}-stage3-{stamp}.xlsx'
+        file_name_current = f'./{path}/{device}-stage4-{stamp}.xlsx'
 
+        df = self.processed_frame()
         df.columns = [
             'Pгет, дБм',
             'Fгет, ГГц',
@@ -159,45 +386,76 @@ class MeasureResult:
             'Pпч, дБм',
             'Кп, дБм',
         ]
-        df.to_excel(file_name_main, engine='openpyxl', index=False)
+        sheets_main = [('Sheet1', df, False)]
+        if len(self._timed()):
+            sheets_main.append(('timing', self._timing_frame(), False))
+            sheets_main.append(('timing summary', pd.DataFrame(self.timing_summary).T, True))
 
-        df = pd.DataFrame({'u': v[0], 'i': v[1]} for v in self.data_i[1])
-        df.columns = ['Uпит, В', 'Iпот, мА']
-        df.to_excel(file_name_current, engine='openpyxl', index=False)
+        df = pd.DataFrame(self.data_i.get(1, np.empty((0, 2))), columns=['Uпит, В', 'Iпот, мА'])
 
-        full_path = os.path.abspath(file_name_main)
-        Popen(f'explorer /select,"{full_path}"')
-
-    def _prepare_table_data(self):
-        table_file = self._primary_params.get('result', '')
-
-        if not os.path.isfile(table_file):
-            return
+        return [
+            (file_name_main, sheets_main),
+            (file_name_current, [('Sheet1', df, False)]),
+        ]
 
-        wb = openpyxl.load_workbook(table_file)
-        ws = wb.active
+    def export_excel(self, progress=None):
+        workbooks = self.excel_workbooks()
+        write_workbooks(workbooks, progress)
+        reveal(workbooks[0][0])
+        return workbooks[0][0]
 
-        rows = list(ws.rows)
-        self._table_header = [row.value for row in rows[0][1:]]
+    def _timing_frame(self):
+        # phase times in seconds, one row per timed point in grid order
+        timed = self._filled & ~np.isnan(self._timings[:, -1])
+        df = pd.DataFrame(self._timings[timed], columns=TIMING_COLUMNS)
+        df.insert(0, 'Fпч, ГГц', self._values[timed, FPCH])
+        df.insert(0, 'Fгет, ГГц', self._values[timed, _col['f_lo']])
+        return df
 
-        gens = [
-            [rows[1][j].value, rows[2][j].value, rows[3][j].value]
-            for j in range(1, ws.max_column)
-        ]
+    def _prepare_table_data(self):
+        table = load_spec_table(self._primary_params.get('result', ''))
+        if table is None:
+            return
 
-        self._table_data = [self._gen_value(col) for col in gens]
+        self._table_header = list(table.header)
+        self._table_data = [self._gen_value(col) for col in table.columns]
 
-    def _gen_value(self, data):
-        if not data:
-            return '-'
-        if '-' in data:
+    def _gen_value(self, column):
+        if column is None:
             return '-'
-        span, step, mean = data
-        start = mean - span
-        stop = mean + span
-        if span == 0 or step == 0:
-            return mean
-        return round(random.randint(0, int((stop - start) / step)) * step + start, 2)
+        start, step, count = column
+        if step is None:
+            return start
+        return round(random.randint(0, count) * step + start, 2)
 
     def get_result_table_data(self):
         return list(self._table_header), list(self._table_data)
+
+
+def main(args):
+    # recomputes a journaled run with another adjustment table or path loss and writes its workbooks:
+    # python measureresult.py journal/+25-<stamp>.jsonl --adjust adjust_+25.ini --loss deltas.ini
+    parser = argparse.ArgumentParser(description='Reprocess a journaled run without measuring it again')
+    parser.add_argument('journal', help='journal/*.jsonl of the run')
+    parser.add_argument('--adjust', default=None, help='adjust_*.ini/.npy to apply, the one the run used by default')
+    parser.add_argument('--loss', default=None, help='path loss in dB, or a deltas.ini-like {MHz: dB} file')
+    opts = parser.parse_args(args[1:])
+
+    loss = opts.loss
+    if loss is not None:
+        try:
+            loss = float(loss)
+        except ValueError:
+            loss = load_ast_if_exists(loss, default=None)
+            if loss is None:
+                parser.error(f'no loss file {opts.loss}')
+
+    result = MeasureResult()
+    result.load_journal(opts.journal)
+    result.reprocess(adjustment=opts.adjust, loss=loss)
+    path = result.export_excel()
+    print(f'{opts.journal}: {result.count} points -> {path}')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
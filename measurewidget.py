@@ -110,6 +110,16 @@ class MeasureWidget(QWidget):
         print('start RF calibration')
         self.calibrate('RF')
 
+    @pyqtSlot()
+    def on_btnCalibrateBoth_clicked(self):
+        print('start LO+RF calibration')
+        self.calibrate('LO+RF')
+
+    @pyqtSlot()
+    def on_btnCalibrateCheck_clicked(self):
+        print('start calibration check')
+        self.calibrate('check')
+
     @pyqtSlot()
     def on_btnMeasure_clicked(self):
         print('start measure')
@@ -135,7 +145,9 @@ class MeasureWidget(QWidget):
         self._ui.btnMeasure.setEnabled(False)
         self._ui.btnCancel.setEnabled(False)
         self._ui.btnCalibrateLO.setEnabled(False)
-        self._ui.btnCalibrateRf.setEnabled(False)
+        self._ui.btnCalibrateRF.setEnabled(False)
+        self._ui.btnCalibrateBoth.setEnabled(False)
+        self._ui.btnCalibrateCheck.setEnabled(False)
         self._devices.enabled = True
 
     def _modePreCheck(self):
@@ -144,6 +156,8 @@ class MeasureWidget(QWidget):
         self._ui.btnCancel.setEnabled(False)
         self._ui.btnCalibrateLO.setEnabled(False)
         self._ui.btnCalibrateRF.setEnabled(False)
+        self._ui.btnCalibrateBoth.setEnabled(False)
+        self._ui.btnCalibrateCheck.setEnabled(False)
         self._devices.enabled = True
 
     def _modeDuringCheck(self):
@@ -152,6 +166,8 @@ class MeasureWidget(QWidget):
         self._ui.btnCancel.setEnabled(False)
         self._ui.btnCalibrateLO.setEnabled(False)
         self._ui.btnCalibrateRF.setEnabled(False)
+        self._ui.btnCalibrateBoth.setEnabled(False)
+        self._ui.btnCalibrateCheck.setEnabled(False)
         self._devices.enabled = False
 
     def _modePreMeasure(self):
@@ -160,6 +176,8 @@ class MeasureWidget(QWidget):
         self._ui.btnCancel.setEnabled(False)
         self._ui.btnCalibrateLO.setEnabled(True)
         self._ui.btnCalibrateRF.setEnabled(True)
+        self._ui.btnCalibrateBoth.setEnabled(True)
+        self._ui.btnCalibrateCheck.setEnabled(True)
         self._devices.enabled = False
 
     def _modeDuringMeasure(self):
@@ -168,6 +186,8 @@ class MeasureWidget(QWidget):
         self._ui.btnCancel.setEnabled(True)
         self._ui.btnCalibrateLO.setEnabled(False)
         self._ui.btnCalibrateRF.setEnabled(False)
+        self._ui.btnCalibrateBoth.setEnabled(False)
+        self._ui.btnCalibrateCheck.setEnabled(False)
         self._devices.enabled = False
 
     def updateWidgets(self, params):
@@ -186,7 +206,8 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._uiDebouncer.setSingleShot(True)
         self._uiDebouncer.timeout.connect(self.on_debounced_gui)
 
-        self._params = 0
+        # per-run options, not saved with the secondary params
+        self._params = {'resume': False}
 
         # region LO params
         self._spinPlo = QDoubleSpinBox(parent=self)
@@ -284,8 +305,17 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinScaleY.setValue(5)
         self._spinScaleY.setSuffix(' дБ')
         self._devices._layout.addRow('Scale y=', self._spinScaleY)
+
+        self._checkTraceMode = QCheckBox(parent=self)
+        self._checkTraceMode.setChecked(False)
+        self._devices._layout.addRow('Одна трасса на Fгет', self._checkTraceMode)
         # endregion
 
+        self._checkResume = QCheckBox(parent=self)
+        self._checkResume.setChecked(False)
+        self._devices._layout.addRow('Продолжить прерванное', self._checkResume)
+        self._checkResume.toggled.connect(self.on_checkResume_toggled)
+
         # region current measure params
         self._lineSeparator = QFrame()
         self._lineSeparator.setFrameShape(QFrame.HLine)
@@ -334,6 +364,7 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
 
         self._spinRefLevel.valueChanged.connect(self.on_params_changed)
         self._spinScaleY.valueChanged.connect(self.on_params_changed)
+        self._checkTraceMode.toggled.connect(self.on_params_changed)
 
         self._spinUmin.valueChanged.connect(self.on_params_changed)
         self._spinUmax.valueChanged.connect(self.on_params_changed)
@@ -361,7 +392,12 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._modeDuringMeasure()
         self._threads.start(
             MeasureTask(
-                self._controller._calibrateLO if what == 'LO' else self._controller._calibrateRF,
+                {
+                    'LO': self._controller._calibrateLO,
+                    'RF': self._controller._calibrateRF,
+                    'LO+RF': self._controller._calibrateBoth,
+                    'check': self._controller._verifyCalibration,
+                }[what],
                 self.calibrateTaskComplete,
                 self._token,
                 [self._selectedDevice, self._params]
@@ -396,6 +432,9 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
                 print('cancelling task')
             self._token.cancelled = True
 
+    def on_checkResume_toggled(self, state):
+        self._params['resume'] = state
+
     def on_params_changed(self, value):
         if value != 1:
             self._uiDebouncer.start(5000)
@@ -413,6 +452,7 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
             'loss': self._spinLoss.value(),
             'ref_level': self._spinRefLevel.value(),
             'scale_y': self._spinScaleY.value(),
+            'is_trace_mode': self._checkTraceMode.isChecked(),
             'Umin': self._spinUmin.value(),
             'Umax': self._spinUmax.value(),
             'Udelta': self._spinUdelta.value(),
@@ -432,6 +472,7 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinLoss.setValue(params['loss'])
         self._spinRefLevel.setValue(params['ref_level'])
         self._spinScaleY.setValue(params['scale_y'])
+        self._checkTraceMode.setChecked(params['is_trace_mode'])
         self._spinUmin.setValue(params['Umin'])
         self._spinUmax.setValue(params['Umax'])
         self._spinUdelta.setValue(params['Udelta'])
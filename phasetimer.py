@@ -0,0 +1,71 @@
+import threading
+import time
+
+import numpy as np
+
+PHASES = ('gen_retune', 'psu_enable', 'settle', 'mult_read', 'sa_retune', 'marker_read')
+
+COLUMNS = (*PHASES, 'total')
+
+PERCENTILES = (50, 90, 99)
+
+
+class PhaseTimer:
+    """
+    Splits the time of every sweep point into phases.
+
+    A phase is the busy time of the calls wrapped with `wrap()`, summed over instruments,
+    so with the pipeline on the phases of a point can add up to more than its `total` wall time.
+    A point starts when the previous one is finished, anything not wrapped shows up only in `total`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = dict.fromkeys(PHASES, 0.0)
+        self._started = time.perf_counter()
+
+    def wrap(self, phase, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self._current[phase] += seconds
+
+    def finish_point(self):
+        now = time.perf_counter()
+        with self._lock:
+            timing = {k: round(v, 4) for k, v in self._current.items()}
+            timing['total'] = round(now - self._started, 4)
+            self._current = dict.fromkeys(PHASES, 0.0)
+            self._started = now
+        return timing
+
+    @staticmethod
+    def spread(phase, seconds, timings):
+        # time spent once for a group of points, e.g. a trace fetch per LO row
+        if not timings:
+            return
+        share = seconds / len(timings)
+        for timing in timings:
+            timing[phase] = round(timing[phase] + share, 4)
+
+
+def summarize(timings):
+    # timings: array of shape (points, len(COLUMNS))
+    if not len(timings):
+        return {}
+    summary = {}
+    for phase, values in zip(COLUMNS, np.asarray(timings).T):
+        summary[phase] = {
+            'mean': round(float(values.mean()), 4),
+            **{f'p{p}': round(float(v), 4) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+            'max': round(float(values.max()), 4),
+            'total': round(float(values.sum()), 3),
+        }
+    return summary
@@ -1,3 +1,4 @@
+import numpy as np
 import pyqtgraph as pg
 
 from PyQt5.QtWidgets import QGridLayout, QWidget, QLabel
@@ -20,6 +21,9 @@ class PrimaryPlotWidget(QWidget):
         self._controller = controller   # TODO decouple from controller, use explicit result passing
         self.only_main_states = False
 
+        # above this many points in view the curves are drawn as lines only
+        self._max_symbols = controller.rigParams['plot_max_symbols']
+
         self._grid = QGridLayout()
 
         self._win = pg.GraphicsLayoutWidget(show=True)
@@ -40,6 +44,15 @@ class PrimaryPlotWidget(QWidget):
         self._curves_00 = dict()
         self._curves_01 = dict()
 
+        # what of the result is on screen already, see plot()
+        self._generation = None
+        self._seen = 0
+        self._data_i = None
+
+        # crosshair lookups, rebuilt on the first mouse move after the curves change
+        self._lookup_00 = None
+        self._lookup_01 = None
+
         self._plot_00.setLabel('left', 'Кп', **self.label_style)
         self._plot_00.setLabel('bottom', 'Fпч, МГц', **self.label_style)
         self._plot_00.enableAutoRange('x')
@@ -53,6 +66,7 @@ class PrimaryPlotWidget(QWidget):
         self._plot_00.addItem(self._vLine_00, ignoreBounds=True)
         self._plot_00.addItem(self._hLine_00, ignoreBounds=True)
         self._proxy_00 = pg.SignalProxy(self._plot_00.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved_00)
+        self._vb_00.sigXRangeChanged.connect(self.on_range_changed_00)
 
         self._plot_01.setLabel('left', 'Iпот, мА', **self.label_style)
         self._plot_01.setLabel('bottom', 'Uпит, В', **self.label_style)
@@ -67,6 +81,7 @@ class PrimaryPlotWidget(QWidget):
         self._plot_01.addItem(self._vLine_01, ignoreBounds=True)
         self._plot_01.addItem(self._hLine_01, ignoreBounds=True)
         self._proxy_01 = pg.SignalProxy(self._plot_01.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved_01)
+        self._vb_01.sigXRangeChanged.connect(self.on_range_changed_01)
 
         self.setLayout(self._grid)
 
@@ -81,10 +96,9 @@ class PrimaryPlotWidget(QWidget):
             if not self._curves_00:
                 return
 
-            self._stat_label.setText(_label_text(x, y, [
-                [f, curve.yData[_find_value_index(curve.xData, x)]]
-                for f, curve in self._curves_00.items()
-            ]))
+            if self._lookup_00 is None:
+                self._lookup_00 = NearestLookup(self._curves_00)
+            self._stat_label.setText(_label_text(x, y, self._lookup_00.values_at(x)))
 
     def mouseMoved_01(self, event):
         pos = event[0]
@@ -97,10 +111,15 @@ class PrimaryPlotWidget(QWidget):
             if not self._curves_01:
                 return
 
-            self._stat_label.setText(_label_text(x, y, [
-                [f, curve.yData[_find_value_index(curve.xData, x)]]
-                for f, curve in self._curves_01.items()
-            ]))
+            if self._lookup_01 is None:
+                self._lookup_01 = NearestLookup(self._curves_01)
+            self._stat_label.setText(_label_text(x, y, self._lookup_01.values_at(x)))
+
+    def on_range_changed_00(self, *_):
+        _update_symbols(self._curves_00, self._vb_00, self._max_symbols)
+
+    def on_range_changed_01(self, *_):
+        _update_symbols(self._curves_01, self._vb_01, self._max_symbols)
 
     def clear(self):
         def _remove_curves(plot, curve_dict):
@@ -113,41 +132,146 @@ class PrimaryPlotWidget(QWidget):
         self._curves_00.clear()
         self._curves_01.clear()
 
+        self._generation = None
+        self._seen = 0
+        self._data_i = None
+
+        # crosshair lookups, rebuilt on the first mouse move after the curves change
+        self._lookup_00 = None
+        self._lookup_01 = None
+
     def plot(self):
-        print('plotting primary stats')
-        _plot_curves(self._controller.result.data, self._curves_00, self._plot_00, 'ГГц')
-        _plot_curves(self._controller.result.data_i, self._curves_01, self._plot_01, '')
+        result = self._controller.result
+
+        # only the LO rows that got new points are redrawn, unless the stored points changed in place
+        if result.generation != self._generation or not result.row_size:
+            self._generation = result.generation
+            _, self._seen = result.added_since(0)
+            _plot_curves(result.data, self._curves_00, self._plot_00, 'ГГц')
+            self._lookup_00 = None
+            _update_symbols(self._curves_00, self._vb_00, self._max_symbols)
+        else:
+            added, self._seen = result.added_since(self._seen)
+            for row in dict.fromkeys(index // result.row_size for index in added):
+                f_lo, data = result.row_curve(row)
+                _plot_curve(self._curves_00, self._plot_00, f_lo, data, 'ГГц')
+            if added:
+                self._lookup_00 = None
+                _update_symbols(self._curves_00, self._vb_00, self._max_symbols, total=result.count)
+
+        data_i = result.data_i.get(1)
+        if data_i is not self._data_i:
+            self._data_i = data_i
+            _plot_curves(result.data_i, self._curves_01, self._plot_01, '')
+            self._lookup_01 = None
+            _update_symbols(self._curves_01, self._vb_01, self._max_symbols)
+
+
+class NearestLookup:
+    """
+    y of the point nearest to a given x on every curve, with one searchsorted for all of them.
+
+    The sorted x of each curve are laid out one after another in a single array,
+    every curve shifted past the end of the previous one, so a query is a vector of
+    the same x shifted the same way.
+    """
+
+    def __init__(self, curves):
+        self.labels = list(curves)
+        xs = [np.asarray(c.xData if c.xData is not None else [], dtype=float) for c in curves.values()]
+        ys = [np.asarray(c.yData if c.yData is not None else [], dtype=float) for c in curves.values()]
+
+        lengths = np.array([len(x) for x in xs])
+        self._starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self._stops = self._starts + lengths
+
+        flat = np.concatenate(xs) if xs else np.empty(0)
+        self._low = flat.min() if len(flat) else 0.0
+        self._width = (flat.max() - self._low if len(flat) else 0.0) + 1.0
+
+        order = [np.argsort(x, kind='stable') for x in xs]
+        self._keys = np.concatenate([x[o] - self._low + i * self._width for i, (x, o) in enumerate(zip(xs, order))]) \
+            if xs else np.empty(0)
+        self._xs = np.concatenate([x[o] for x, o in zip(xs, order)]) if xs else np.empty(0)
+        self._ys = np.concatenate([y[o] for y, o in zip(ys, order)]) if ys else np.empty(0)
+
+    def values_at(self, x):
+        """[label, y] per curve, nan for an empty curve."""
+        if not self.labels:
+            return []
+        offset = np.clip(x - self._low, 0.0, self._width - 1.0)
+        pos = np.searchsorted(self._keys, offset + np.arange(len(self.labels)) * self._width)
+
+        right = np.minimum(pos, self._stops - 1)
+        left = np.maximum(pos - 1, self._starts)
+        empty = self._stops == self._starts
+        right[empty] = left[empty] = 0
+
+        pick = np.where(np.abs(self._xs[left] - x) <= np.abs(self._xs[right] - x), left, right) \
+            if len(self._xs) else right
+        values = np.where(empty, np.nan, self._ys[pick] if len(self._ys) else np.nan)
+        return [[label, value] for label, value in zip(self.labels, values.tolist())]
 
 
 def _plot_curves(datas, curves, plot, unit):
     for f_lo, data in datas.items():
-        curve_xs, curve_ys = zip(*data)
+        _plot_curve(curves, plot, f_lo, data, unit)
+
+
+def _plot_curve(curves, plot, f_lo, data, unit):
+    # data is an (n, 2) array, its columns go to pyqtgraph as views
+    curve_xs, curve_ys = data[:, 0], data[:, 1]
+    try:
+        curves[f_lo].setData(x=curve_xs, y=curve_ys)
+    except KeyError:
         try:
-            curves[f_lo].setData(x=curve_xs, y=curve_ys)
-        except KeyError:
-            try:
-                color = colors[len(curves)]
-            except IndexError:
-                color = colors[len(curves) - len(colors)]
-            curves[f_lo] = pg.PlotDataItem(
-                curve_xs,
-                curve_ys,
-                pen=pg.mkPen(
-                    color=color,
-                    width=2,
-                ),
-                symbol='o',
-                symbolSize=5,
-                symbolBrush=color,
-                name=f'{f_lo} {unit}'
-            )
-            plot.addItem(curves[f_lo])
+            color = colors[len(curves)]
+        except IndexError:
+            color = colors[len(curves) - len(colors)]
+        # symbols start on, _update_symbols() drops them for dense data;
+        # downsampling and clipping follow the view, zooming in brings back every point
+        curves[f_lo] = pg.PlotDataItem(
+            curve_xs,
+            curve_ys,
+            pen=pg.mkPen(
+                color=color,
+                width=2,
+            ),
+            symbol='o',
+            symbolSize=5,
+            symbolBrush=color,
+            name=f'{f_lo} {unit}',
+            skipFiniteCheck=True,
+        )
+        plot.addItem(curves[f_lo])
+        # only once the curve is in the view box, pyqtgraph looks the view range up while adding
+        curves[f_lo].setDownsampling(auto=True, method='peak')
+        curves[f_lo].setClipToView(True)
+
+
+def _update_symbols(curves, view_box, max_symbols, total=None):
+    """Symbols on while at most `max_symbols` points are in view, `total` is a cheap upper bound when known."""
+    if total is None or total > max_symbols:
+        total = _points_in_view(curves, view_box)
+    show = total <= max_symbols
+    for curve in curves.values():
+        if (curve.opts['symbol'] is not None) != show:
+            curve.setSymbol('o' if show else None)
+
+
+def _points_in_view(curves, view_box):
+    x_auto, _ = view_box.autoRangeEnabled()
+    x_min, x_max = view_box.viewRange()[0]
+    count = 0
+    for curve in curves.values():
+        xs = curve.xData
+        if xs is None:
+            continue
+        count += len(xs) if x_auto else int(np.count_nonzero((xs >= x_min) & (xs <= x_max)))
+    return count
 
 
 def _label_text(x, y, vals):
     vals_str = ''.join(f'   <span style="color:{colors[i]}">{f:0.1f}={v:0.2f}</span>' for i, (f, v) in enumerate(vals))
     return f"<span style='font-size: 8pt'>x={x:0.2f},   y={y:0.2f}   {vals_str}</span>"
 
-
-def _find_value_index(freqs: list, freq):
-    return min(range(len(freqs)), key=lambda i: abs(freqs[i] - freq))
@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def parse_trace(answer):
+    return np.array(answer.strip().split(','), dtype=float)
+
+
+def tone_levels(trace, f_start, f_stop, tones, window):
+    """
+    Peak level of every tone in a single analyzer trace.
+
+    `tones` and `window` are in the same units as `f_start`/`f_stop`,
+    each tone is searched within +-window around its nominal frequency.
+    """
+    trace = np.asarray(trace, dtype=float)
+    tones = np.asarray(tones, dtype=float)
+
+    if len(trace) < 2:
+        return np.full(len(tones), trace.max() if len(trace) else np.nan)
+
+    bin_width = (f_stop - f_start) / (len(trace) - 1)
+    centres = np.rint((tones - f_start) / bin_width).astype(int)
+    half = int(np.ceil(window / bin_width))
+
+    index = np.clip(centres[:, None] + np.arange(-half, half + 1)[None, :], 0, len(trace) - 1)
+    return trace[index].max(axis=1)
@@ -0,0 +1,106 @@
+import queue
+import threading
+
+from concurrent.futures import Future, wait
+
+
+class InstrumentQueue:
+    """
+    Runs commands for a single instrument in order on its own thread.
+    Every call returns a Future, so independent boxes can work at the same time.
+
+    The first failed command stops the queue: everything queued after it fails with the same error,
+    so a dropped write future still surfaces on the next waited settle or read of that box.
+    """
+
+    def __init__(self, name, instrument):
+        self.name = name
+        self.instrument = instrument
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'queue {name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def send(self, command):
+        return self.submit(self.instrument.send, command)
+
+    def query(self, question):
+        return self.submit(self.instrument.query, question)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self.error is not None:
+                future.set_exception(self.error)
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as ex:
+                self.error = ex
+                future.set_exception(ex)
+
+
+class DirectQueue(InstrumentQueue):
+    """Same interface as InstrumentQueue, but runs every call immediately on the caller thread, errors raise right there."""
+
+    def __init__(self, name, instrument):
+        self.name = name
+        self.instrument = instrument
+        self.error = None
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+    def stop(self):
+        pass
+
+
+class Scheduler:
+    def __init__(self, instruments, pipelined=True):
+        queue_cls = InstrumentQueue if pipelined else DirectQueue
+        self._queues = {name: queue_cls(name, instr) for name, instr in instruments.items()}
+
+    def __getitem__(self, name):
+        return self._queues[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        if exc_type is None:
+            self.raise_error()
+
+    def close(self):
+        for q in self._queues.values():
+            q.stop()
+
+    def raise_error(self):
+        """Re-raises the first instrument error, covers commands queued after the last wait."""
+        for q in self._queues.values():
+            if q.error is not None:
+                raise q.error
+
+
+def wait_all(*futures):
+    done, _ = wait(futures)
+    for f in done:
+        f.result()   # re-raise instrument errors on the sweep thread
@@ -0,0 +1,114 @@
+import re
+
+# optional root nodes, 'SOUR:FREQ' and 'FREQ' address the same setting
+_OPTIONAL_ROOTS = ('SOUR', 'SENS')
+
+# default sub-nodes, 'OUTP:STAT ON' is the same setting as 'OUTP ON'
+_ALIASES = {
+    'OUTP:STAT': 'OUTP',
+    'FREQ:CW': 'FREQ',
+    'FREQ:FIX': 'FREQ',
+    'POW:LEV': 'POW',
+    'POW:AMPL': 'POW',
+    'POW:LEV:IMM:AMPL': 'POW',
+}
+
+# setting one node of a group changes the others
+_COUPLED = [
+    {'FREQ:CENT', 'FREQ:SPAN', 'FREQ:STAR', 'FREQ:STOP'},
+    {'FREQ', 'FREQ:MULT'},
+]
+
+# headers that act rather than set state, never cached
+_VOLATILE_ROOTS = ('INIT', 'TRIG', 'ABOR', 'MEAS', 'READ', 'FETC', 'SYST')
+
+# headers that change what the following commands address, or reconfigure the box
+_CONTEXT_ROOTS = ('INST', 'MEAS', 'CONF')
+
+_mnemonic_re = re.compile(r'^([A-Z]+)(\d*)$')
+
+
+def _short(mnemonic):
+    match = _mnemonic_re.match(mnemonic.upper())
+    if not match:
+        return mnemonic.upper()
+    name, suffix = match.groups()
+    if len(name) > 4:
+        name = name[:3] if name[3] in 'AEIOU' else name[:4]
+    return name + suffix
+
+
+def normalize(header):
+    nodes = [_short(m) for m in header.strip(':').split(':') if m]
+    if len(nodes) > 1 and nodes[0] in _OPTIONAL_ROOTS:
+        nodes = nodes[1:]
+    key = ':'.join(nodes)
+    return _ALIASES.get(key, key)
+
+
+class CachedInstrument:
+    """
+    Wraps an instrument from instr.instrumentfactory and drops sends
+    that would set a node to the value it already has.
+    """
+
+    def __init__(self, instrument):
+        self._instrument = instrument
+        self._state = dict()
+
+        self.sent = 0
+        self.dropped = 0
+
+    def __getattr__(self, item):
+        return getattr(self._instrument, item)
+
+    def __str__(self):
+        return str(self._instrument)
+
+    def __repr__(self):
+        return repr(self._instrument)
+
+    def send(self, command):
+        header, _, value = command.strip().partition(' ')
+        if header.startswith('*'):
+            if header.upper() == '*RST':
+                self.invalidate()
+            return self._send(command)
+
+        key = normalize(header)
+        root = key.split(':')[0]
+
+        if root in _CONTEXT_ROOTS:
+            self.invalidate()
+        if not value or root in _VOLATILE_ROOTS:
+            return self._send(command)
+
+        value = value.replace(' ', '').upper()
+        if self._state.get(key) == value:
+            self.dropped += 1
+            return None
+
+        result = self._send(command)
+        for group in _COUPLED:
+            if key in group:
+                for coupled in group - {key}:
+                    self._state.pop(coupled, None)
+        self._state[key] = value
+        return result
+
+    def query(self, question):
+        root = normalize(question.strip().partition(' ')[0].rstrip('?')).split(':')[0]
+        if root in _CONTEXT_ROOTS:
+            self.invalidate()
+        return self._instrument.query(question)
+
+    def invalidate(self):
+        self._state.clear()
+
+    def reset_stats(self):
+        self.sent = 0
+        self.dropped = 0
+
+    def _send(self, command):
+        self.sent += 1
+        return self._instrument.send(command)
@@ -0,0 +1,129 @@
+import time
+
+from collections import defaultdict
+
+import applog
+from instr.instrumentfactory import mock_enabled
+from forgot_again.file import pprint_to_file
+
+log = applog.get_logger('settle')
+
+
+class SettleEngine:
+    """
+    Waits for real instrument completion instead of fixed sleeps.
+
+    Every wait is recorded together with the fixed delay it replaces,
+    so tolerances can be tuned from the observed numbers.
+    """
+
+    def __init__(self, params):
+        self.use_opc = params['settle_opc']
+        self.timeouts = dict(params['settle_timeout'])
+        self.tolerances = dict(params['settle_tolerance'])
+        self.poll = params['settle_poll']
+        self.reads = params['settle_reads']
+
+        self.observed = defaultdict(list)
+        self.replaced = defaultdict(float)
+
+        # instruments that failed *OPC? once, they get the fixed delay for the rest of the session
+        self._no_opc = set()
+
+    def reset(self):
+        self.observed.clear()
+        self.replaced.clear()
+
+    def wait(self, name, instrument, fixed):
+        if mock_enabled:
+            return 0.0
+
+        start = time.perf_counter()
+        if self.use_opc and name not in self._no_opc:
+            try:
+                instrument.query('*OPC?')
+            except Exception as ex:
+                log.warning('*OPC? failed on %s, using the fixed delay from now on: %s', name, ex)
+                self._no_opc.add(name)
+                self._sleep_fixed(name, fixed)
+        else:
+            self._sleep_fixed(name, fixed)
+        return self._record(name, start, fixed)
+
+    def _sleep_fixed(self, name, fixed):
+        # never longer than the delay being replaced, settle_timeout can only shorten it
+        time.sleep(min(self.timeouts.get(name, fixed), fixed))
+
+    def read_stable(self, name, instrument, question, fixed=0.0, trigger=False):
+        """
+        Polls `question` until `settle_reads` answers agree within the tolerance.
+
+        With `trigger` every read comes from a fresh single sweep (the analyzer runs with :INIT:CONT OFF),
+        otherwise a stopped trace would answer the same stale value every time.
+        """
+        if mock_enabled:
+            return float(instrument.query(question))
+
+        start = time.perf_counter()
+        timeout = self.timeouts.get(name, fixed)
+        tolerance = self.tolerances.get(name, 0.0)
+
+        if trigger:
+            self._sweep(name, instrument)
+        value = float(instrument.query(question))
+        agreed = 1
+        while agreed < self.reads and time.perf_counter() - start < timeout:
+            if trigger:
+                self._sweep(name, instrument)
+            else:
+                time.sleep(self.poll)
+            new_value = float(instrument.query(question))
+            agreed = agreed + 1 if abs(new_value - value) <= tolerance else 1
+            value = new_value
+
+        if agreed < self.reads:
+            log.warning('%s did not settle within %s s, %s of %s reads agreed, last value %s used',
+                        name, timeout, agreed, self.reads, value)
+        self._record(name, start, fixed)
+        return value
+
+    def _sweep(self, name, instrument):
+        if self.use_opc and name not in self._no_opc:
+            try:
+                instrument.query(':INIT:IMM;*OPC?')
+                return
+            except Exception as ex:
+                log.warning('*OPC? failed on %s, using the fixed delay from now on: %s', name, ex)
+                self._no_opc.add(name)
+        # no completion to wait for, give the sweep the full settle timeout
+        instrument.send(':INIT:IMM')
+        time.sleep(self.timeouts.get(name, self.poll))
+
+    def _record(self, name, start, fixed):
+        elapsed = time.perf_counter() - start
+        self.observed[name].append(round(elapsed, 4))
+        self.replaced[name] += fixed
+        return elapsed
+
+    @property
+    def stats(self):
+        return {
+            name: {
+                'count': len(times),
+                'mean': round(sum(times) / len(times), 4),
+                'max': max(times),
+                'total': round(sum(times), 3),
+                'saved': round(self.replaced[name] - sum(times), 3),
+            }
+            for name, times in self.observed.items() if times
+        }
+
+    @property
+    def saved(self):
+        return round(sum(s['saved'] for s in self.stats.values()), 3)
+
+    def save(self, path):
+        pprint_to_file(path, {
+            'stats': self.stats,
+            'observed': {k: list(v) for k, v in self.observed.items()},
+        })
@@ -0,0 +1,387 @@
+import math
+import random
+import threading
+import time
+
+from collections import defaultdict
+
+import numpy as np
+
+from scpicache import normalize
+
+_units = {
+    'GHZ': 1e9, 'MHZ': 1e6, 'KHZ': 1e3, 'HZ': 1.0,
+    'DBM': 1.0, 'DB': 1.0,
+    'MV': 1e-3, 'V': 1.0,
+    'MA': 1e-3, 'A': 1.0,
+}
+
+
+def _number(value):
+    value = value.strip().upper()
+    for unit, mult in _units.items():
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * mult
+    return float(value)
+
+
+def _marker(key):
+    # CALC:MARK2:Y -> 2, a marker without a number is marker 1
+    number = key.split(':')[1][len('MARK'):]
+    return int(number) if number.isdigit() else 1
+
+
+def _cable_loss(freq):
+    # dB, generator -> DUT/analyzer cable, grows with frequency
+    return 1.0 + 0.9 * freq / 1e9
+
+
+def _conversion_loss(f_lo, f_if, p_lo):
+    # dB, demodulator conversion loss, LO starvation below -2 dBm
+    return 6.5 + 0.004 * f_if / 1e6 + 0.5 * (f_lo / 1e9 - 1) + max(0.0, -2.0 - p_lo) * 1.2
+
+
+class SimRig:
+    """
+    Virtual test rig: analyzer, two generators, PSU and multimeter stand-ins
+    sharing one physical model of the demodulator under test.
+
+    Latency and settling come from rig.ini, `sim_time_scale` stretches or shrinks every delay.
+    """
+
+    def __init__(self, params):
+        self.latency = dict(params['sim_latency'])
+        self.settle = dict(params['sim_settle'])
+        self.noise = params['sim_noise']
+        self.time_scale = params['sim_time_scale']
+
+        self.lock = threading.RLock()
+        self.changed_at = defaultdict(float)
+
+        self.sends = defaultdict(int)
+        self.queries = defaultdict(int)
+
+        self.gen_lo = SimGenerator(self, 'P LO', 'GPIB1::6::INSTR')
+        self.gen_rf = SimGenerator(self, 'P RF', 'GPIB1::20::INSTR')
+        self.src = SimSource(self, 'Источник', 'GPIB1::3::INSTR')
+        self.mult = SimMultimeter(self, 'Мультиметр', 'GPIB1::22::INSTR')
+        self.sa = SimAnalyzer(self, 'Анализатор', 'GPIB1::18::INSTR')
+
+    def instruments(self):
+        return {
+            'Анализатор': self.sa,
+            'P LO': self.gen_lo,
+            'P RF': self.gen_rf,
+            'Источник': self.src,
+            'Мультиметр': self.mult,
+        }
+
+    def reset_stats(self):
+        self.sends.clear()
+        self.queries.clear()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def touch(self, name):
+        with self.lock:
+            self.changed_at[name] = time.perf_counter()
+
+    def settling_error(self, names, amplitude, now=None):
+        # reading error decays exponentially after the last change of any of `names`
+        if now is None:
+            now = time.perf_counter()
+        error = 0.0
+        for name in names:
+            tau = self.settle.get(name, 0.0) * self.time_scale / 3
+            if tau <= 0:
+                continue
+            error += amplitude * math.exp(-(now - self.changed_at[name]) / tau)
+        return error
+
+    def tones(self):
+        """Every tone the analyzer can see, as (actual frequency, level at the analyzer)."""
+        with self.lock:
+            tones = []
+            lo = self.gen_lo.actual()
+            rf = self.gen_rf.actual()
+            for freq, pow_ in (lo, rf):
+                if freq is not None:
+                    tones.append((freq, pow_ - _cable_loss(freq)))
+
+            if lo[0] is not None and rf[0] is not None and self.src.is_on:
+                f_lo, p_lo = lo[0], lo[1] - _cable_loss(lo[0])
+                f_rf, p_rf = rf[0], rf[1] - _cable_loss(rf[0])
+                f_if = abs(f_rf - f_lo)
+                tones.append((f_if, p_rf - _conversion_loss(f_lo, f_if, p_lo) - 0.3))
+            return tones
+
+    def dut_current(self):
+        with self.lock:
+            if not self.src.is_on:
+                return 0.0
+            u = self.src.voltage
+            lo = self.gen_lo.actual()
+            drive = 0.0
+            if lo[0] is not None:
+                drive = 0.0003 * 10 ** ((lo[1] - _cable_loss(lo[0])) / 10)
+            return 0.0956 + 0.00135 * u + drive
+
+
+class SimInstrument:
+    model = ''
+
+    def __init__(self, rig, name, addr):
+        self._rig = rig
+        self._name = name
+        self._addr = addr
+        self._busy_until = 0.0
+        self._reset()
+
+    def __str__(self):
+        return f'{self.model} sim'
+
+    def __repr__(self):
+        return f'{self.__class__}(idn={self.idn})'
+
+    def send(self, command):
+        rig = self._rig
+        rig.sends[self._name] += 1
+        rig.sleep(rig.latency.get(self._name, (0.0, 0.0))[0])
+
+        header, _, value = command.strip().partition(' ')
+        if header.upper() == '*RST':
+            self._reset()
+        elif header.upper() == '*TRG':
+            self._trigger()
+        else:
+            self._set(normalize(header), value.strip())
+        return 'success'
+
+    def query(self, question):
+        # ':INIT:IMM;*OPC?' - every command but the last one is a send
+        *commands, question = question.split(';')
+        for command in commands:
+            self.send(command)
+
+        rig = self._rig
+        rig.queries[self._name] += 1
+        rig.sleep(rig.latency.get(self._name, (0.0, 0.0))[1])
+
+        header, _, value = question.strip().partition(' ')
+        header = header.upper()
+        if header == '*OPC?':
+            remaining = self._busy_until - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            return '1'
+        if header == '*IDN?':
+            return self.idn
+        return self._get(normalize(header.rstrip('?')), value.strip())
+
+    def _changed(self):
+        self._rig.touch(self._name)
+        settle = self._rig.settle.get(self._name, 0.0) * self._rig.time_scale
+        self._busy_until = max(self._busy_until, time.perf_counter() + settle)
+
+    def _reset(self):
+        pass
+
+    def _trigger(self):
+        pass
+
+    def _set(self, key, value):
+        pass
+
+    def _get(self, key, value):
+        return '0'
+
+    @property
+    def idn(self):
+        return f'Sim,{self.model},0,0'
+
+    @property
+    def name(self):
+        return self.model
+
+    @property
+    def addr(self):
+        return self._addr
+
+    @property
+    def status(self):
+        return f'{self.model} sim at {self.addr}'
+
+
+class SimGenerator(SimInstrument):
+    model = 'N5183A'
+
+    def _reset(self):
+        self.freq = 1e9
+        self.pow = -20.0
+        self.mult = 1.0
+        self.output = False
+        self.list_mode = False
+        self.list_freq = []
+        self.list_pow = []
+        self.list_index = -1
+
+    def _trigger(self):
+        if self.list_mode and self.list_freq:
+            self.list_index = (self.list_index + 1) % len(self.list_freq)
+            self._changed()
+
+    def _set(self, key, value):
+        with self._rig.lock:
+            if key == 'FREQ':
+                self.freq = _number(value)
+            elif key == 'POW':
+                self.pow = _number(value)
+            elif key == 'FREQ:MULT':
+                self.mult = _number(value)
+            elif key == 'OUTP':
+                self.output = value.upper() in ('ON', '1')
+            elif key == 'LIST:FREQ':
+                self.list_freq = [float(v) for v in value.split(',')]
+            elif key == 'LIST:POW':
+                self.list_pow = [float(v) for v in value.split(',')]
+            elif key == 'FREQ:MODE':
+                self.list_mode = value.upper().startswith('LIST')
+            elif key == 'INIT':
+                self.list_index = -1
+            else:
+                return
+        self._changed()
+
+    def actual(self):
+        if not self.output:
+            return None, None
+        if self.list_mode and self.list_index >= 0:
+            return self.list_freq[self.list_index] / self.mult, self.list_pow[self.list_index]
+        return self.freq / self.mult, self.pow
+
+
+class SimSource(SimInstrument):
+    model = 'E3648A'
+
+    def _reset(self):
+        self.voltage = 0.0
+        self.is_on = False
+
+    def _set(self, key, value):
+        with self._rig.lock:
+            if key == 'APPL':
+                channel, volts, *_ = value.split(',')
+                if channel.strip().upper() == 'P6V':
+                    self.voltage = _number(volts)
+            elif key == 'OUTP':
+                self.is_on = value.upper() in ('ON', '1')
+            else:
+                return
+        self._changed()
+        self._rig.touch('DUT')
+
+
+class SimMultimeter(SimInstrument):
+    model = '34410A'
+
+    def _get(self, key, value):
+        if key.startswith('MEAS:CURR'):
+            rig = self._rig
+            current = rig.dut_current()
+            current += rig.settling_error(['DUT'], current * 0.05)
+            current += random.gauss(0, 2e-6)
+            return f'{current:.9e}'
+        return '0'
+
+
+class SimAnalyzer(SimInstrument):
+    model = 'N9030A'
+    noise_floor = -90.0
+
+    def _reset(self):
+        self.center = 1e9
+        self.span = 1e6
+        self.offset = 0.0
+        self.markers = {}
+        self.points = 1001
+        self.continuous = True
+        self.trace_mode = 'WRIT'
+        self.trace = None
+        # (tones, time the sweep ended) of the last triggered sweep
+        self.swept = None
+
+    def _changed(self):
+        # retuning is instant, *OPC? only waits for a triggered sweep to finish
+        self._rig.touch(self._name)
+
+    def _set(self, key, value):
+        if key == 'FREQ:CENT':
+            self.center = _number(value) - self.offset
+        elif key == 'FREQ:SPAN':
+            self.span = _number(value)
+        elif key == 'FREQ:STAR':
+            start, stop = _number(value), self.center + self.span / 2
+            self.center, self.span = (start + stop) / 2, stop - start
+        elif key == 'FREQ:STOP':
+            start, stop = self.center - self.span / 2, _number(value)
+            self.center, self.span = (start + stop) / 2, stop - start
+        elif key == 'DISP:WIND:TRAC:X:OFFS':
+            self.offset = _number(value)
+        elif key.startswith('CALC:MARK') and key.endswith(':X:CENT'):
+            self.markers[_marker(key)] = _number(value) - self.offset
+        elif key == 'SWE:POIN':
+            self.points = int(_number(value))
+        elif key == 'INIT:CONT':
+            self.continuous = value.upper() in ('ON', '1')
+        elif key == 'TRAC1:MODE':
+            self.trace_mode = value.upper()[:4]
+            if self.trace_mode == 'WRIT':
+                self.trace = None
+        elif key == 'INIT:IMM' or key == 'INIT':
+            self._sweep()
+            return
+        else:
+            return
+        self._changed()
+
+    def _sweep(self):
+        rig = self._rig
+        end = time.perf_counter() + rig.settle.get(self._name, 0.0) * rig.time_scale
+        self._busy_until = max(self._busy_until, end)
+        self.swept = (rig.tones(), end)
+
+        trace = self._render(self._freqs())
+        if self.trace_mode == 'MAXH' and self.trace is not None and len(self.trace) == len(trace):
+            trace = np.maximum(self.trace, trace)
+        self.trace = trace
+
+    def _freqs(self):
+        return np.linspace(self.center - self.span / 2, self.center + self.span / 2, self.points)
+
+    def _rbw(self):
+        return max(3 * self.span / max(self.points - 1, 1), 1e3)
+
+    def _render(self, freqs, tones=None):
+        levels = np.full(len(freqs), self.noise_floor) + np.random.normal(0, 0.5, len(freqs))
+        rbw = self._rbw()
+        for freq, level in tones if tones is not None else self._rig.tones():
+            levels = np.maximum(levels, level - 12 * ((freqs - freq) / rbw) ** 2)
+        return levels
+
+    def _get(self, key, value):
+        rig = self._rig
+        if key.startswith('CALC:MARK') and key.endswith(':Y'):
+            # a stopped analyzer shows what its last sweep saw, a running one follows the rig
+            tones, at = self.swept if not self.continuous and self.swept else (None, None)
+            level = float(self._render(np.array([self.markers.get(_marker(key), 1e9)]), tones)[0])
+            level += rig.settling_error(['P LO', 'P RF', 'Источник', self._name], 3.0, at)
+            level += random.gauss(0, rig.noise)
+            return f'{level:.3f}'
+        if key == 'TRAC:DATA' or key == 'TRAC':
+            trace = self.trace if self.trace is not None else self._render(self._freqs())
+            return ','.join(f'{v:.3f}' for v in trace)
+        if key == 'SWE:POIN':
+            return str(self.points)
+        return '0'
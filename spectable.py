@@ -0,0 +1,67 @@
+import os
+
+from collections import namedtuple
+
+import openpyxl
+
+import applog
+
+log = applog.get_logger('spectable')
+
+# header: column titles, columns: one compiled column per title, see _compile()
+SpecTable = namedtuple('SpecTable', 'header columns')
+
+_cache = dict()
+
+
+def load_spec_table(path):
+    """
+    Parsed result spec workbook (table_+25.xlsx etc.), None if there is no such file.
+
+    The first row holds the titles, rows 2-4 hold span, step and mean of every column, the first
+    column is row labels. A parsed table is kept until the file changes on disk.
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+    key = os.path.abspath(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    table = _parse(path)
+    _cache[key] = (stamp, table)
+    log.debug('%s: %s columns parsed', path, len(table.columns))
+    return table
+
+
+def _parse(path):
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = [list(row) for row in wb.active.iter_rows(min_row=1, max_row=4, values_only=True)]
+    finally:
+        # a read-only workbook keeps the file open until closed
+        wb.close()
+
+    width = max((len(row) for row in rows), default=0)
+    rows = [row + [None] * (width - len(row)) for row in rows + [[]] * (4 - len(rows))]
+
+    header = tuple(rows[0][1:])
+    columns = tuple(_compile([rows[1][j], rows[2][j], rows[3][j]]) for j in range(1, width))
+    return SpecTable(header, columns)
+
+
+def _compile(data):
+    # None for a '-' column, (mean, None, None) for a fixed value,
+    # (start, step, count) for a value picked from start + k * step, k in 0..count
+    if '-' in data or None in data:
+        return None
+    span, step, mean = data
+    if span == 0 or step == 0:
+        return mean, None, None
+    start = mean - span
+    stop = mean + span
+    return start, step, int((stop - start) / step)
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen
+
+import openpyxl
+
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import applog
+
+log = applog.get_logger('xlsx')
+
+# rows between progress reports
+PROGRESS_STEP = 500
+
+_bold = Font(bold=True)
+
+
+def count_rows(workbooks):
+    return sum(len(frame) for _, sheets in workbooks for _, frame, _ in sheets)
+
+
+def write_workbooks(workbooks, progress=None):
+    """
+    Writes every workbook of `workbooks`, a list of (path, sheets), each in its own thread.
+
+    sheets are (sheet name, DataFrame, whether to write the index). `progress(done, total)` is called
+    from the writer threads with the number of data rows written so far.
+    """
+    lock = threading.Lock()
+    total = count_rows(workbooks)
+    done = 0
+
+    def advance(rows):
+        nonlocal done
+        with lock:
+            done += rows
+            current = done
+        if progress is not None:
+            progress(current, total)
+
+    with ThreadPoolExecutor(max_workers=len(workbooks) or 1, thread_name_prefix='xlsx') as pool:
+        futures = [pool.submit(write_workbook, path, sheets, advance) for path, sheets in workbooks]
+        # re-raises the first writer error
+        return [f.result() for f in futures]
+
+
+def write_workbook(path, sheets, advance=None):
+    # write-only workbook, rows go to a temp file as they come instead of building the cell tree in memory
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    wb = openpyxl.Workbook(write_only=True)
+    for name, frame, index in sheets:
+        ws = wb.create_sheet(title=name)
+
+        header = ([frame.index.name or ''] if index else []) + [str(c) for c in frame.columns]
+        ws.append([_header_cell(ws, value) for value in header])
+
+        # NaN is not a valid Excel number, such cells stay empty
+        rows = frame.astype(object).where(frame.notna(), None).itertuples(index=index, name=None)
+        pending = 0
+        for row in rows:
+            ws.append(row)
+            pending += 1
+            if pending == PROGRESS_STEP and advance:
+                advance(pending)
+                pending = 0
+        if pending and advance:
+            advance(pending)
+
+    wb.save(path)
+    log.info('%s written', path)
+    return path
+
+
+def _header_cell(ws, value):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.font = _bold
+    return cell
+
+
+def reveal(path):
+    """Shows the file in Explorer, elsewhere just logs where it is."""
+    full_path = os.path.abspath(path)
+    if sys.platform != 'win32':
+        log.info('saved %s', full_path)
+        return
+    Popen(f'explorer /select,"{full_path}"')